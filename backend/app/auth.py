@@ -1,10 +1,18 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
+import asyncio
 import os
+import threading
+import time
+import uuid
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from . import models, database
 from .schemas import UserCreate, UserLogin, Token, UserResponse
@@ -13,14 +21,98 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production") or
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_TOKEN_USER_ID = os.getenv("AUTH_TOKEN_USER_ID", "true").lower() == "true"
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+# min/max pin the work factor, so hashes made with any other cost are upgraded on the next login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
+
+class UserCache:
+    """In-process LRU of resolved users, keyed by token id, with a TTL bound on staleness."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    def put(self, key, user):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in [key for key, (user, _) in self._entries.items() if user.id == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+user_cache = UserCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate_user(target.id)
+
+# bcrypt gets its own small pool so a login burst cannot occupy the threadpool shared by sync endpoints.
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+async def run_password_work(fn, *args):
+    if not _password_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent sign-in requests, please retry",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        future = password_executor.submit(fn, *args)
+    except BaseException:
+        _password_slots.release()
+        raise
+    future.add_done_callback(lambda _: _password_slots.release())
+    return await asyncio.wrap_future(future)
+
+async def get_password_hash_async(password):
+    return await run_password_work(pwd_context.hash, password)
+
+def token_claims(user: models.User) -> dict:
+    claims = {"sub": user.username}
+    if AUTH_TOKEN_USER_ID:
+        claims["uid"] = user.id
+    return claims
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -28,11 +120,28 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    return resolve_user(token, db)
+
+def get_stream_user(token: Optional[str] = Query(None), header_token: Optional[str] = Depends(optional_oauth2_scheme)):
+    """Auth for long-lived streams: EventSource cannot send headers, and the session is released before streaming."""
+    if not (header_token or token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    db = database.SessionLocal()
+    try:
+        return resolve_user(header_token or token, db)
+    finally:
+        db.close()
+
+def resolve_user(token: str, db: Session):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -45,15 +154,41 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == username).first()
+    
+    cache_key = payload.get("jti") or username
+    user = user_cache.get(cache_key)
+    if user is not None:
+        return user
+    
+    user_id = payload.get("uid")
+    if user_id is not None:
+        user = db.get(models.User, user_id)
+        if user is not None and user.username != username:
+            user = None
+    else:
+        user = db.query(models.User).filter(models.User.username == username).first()
     if user is None:
         raise credentials_exception
+    # Detach so the cached instance is not expired by commits in this request's session.
+    db.expunge(user)
+    user_cache.put(cache_key, user)
     return user
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(models.User).filter(models.User.username == username).first()
+def _find_user(db: Session, username: str):
+    return db.query(models.User).filter(models.User.username == username).first()
+
+def _store_hash(db: Session, user: models.User, hashed_password: str):
+    user.hashed_password = hashed_password
+    db.commit()
+
+async def authenticate_user_async(db: Session, username: str, password: str):
+    # Queries and commits go to the threadpool (SQLite may wait on a lock); only bcrypt is awaited here.
+    user = await run_in_threadpool(_find_user, db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await run_password_work(pwd_context.verify_and_update, password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        await run_in_threadpool(_store_hash, db, user, new_hash)
     return user
@@ -1,22 +1,74 @@
+import logging
 import os
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.routers import auth, invoices, users, settings
-from app import models
-from app.database import engine
+from app import database, prestart
+from app.auth import password_executor, pwd_context
+from app.services import compression, events, jobs, llm, metrics, parsing
 
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Invoice Extraction API")
+# Production runs `python -m app.prestart` once before the workers start and turns this off.
+DB_SETUP_ON_STARTUP = os.getenv("DB_SETUP_ON_STARTUP", "true").lower() == "true"
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "2"))
+
+def preload():
+    """Load what the first requests need but module import leaves lazy.
+
+    gunicorn calls this in the master before forking (gunicorn.conf.py), so workers share the pages.
+    """
+    import openai  # noqa: F401
+
+    pwd_context.handler().get_backend()
+
+async def warm_up():
+    start = time.perf_counter()
+    await run_in_threadpool(preload)
+    await run_in_threadpool(database.warm_pool, WARMUP_DB_CONNECTIONS)
+    llm.warm_default_client()
+    logger.info("Warm-up finished in %.2fs", time.perf_counter() - start)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_SETUP_ON_STARTUP:
+        await run_in_threadpool(prestart.setup)
+    if STARTUP_WARMUP:
+        try:
+            await warm_up()
+        except Exception:
+            logger.warning("Warm-up failed; the first requests will pay for it instead", exc_info=True)
+    await events.start()
+    # Parser processes are warmed by whichever process ends up running the queue.
+    await jobs.start(warm_parsers=STARTUP_WARMUP)
+    yield
+    await jobs.stop()
+    await events.stop()
+    await llm.close_clients()
+    parsing.shutdown_pool()
+    password_executor.shutdown(wait=False)
+
+app = FastAPI(title="Invoice Extraction API", lifespan=lifespan)
 
 cors_origins = os.getenv("CORS_ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:3000").split(",")
 
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+app.add_middleware(compression.CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
@@ -31,3 +83,9 @@ def root():
 @app.get("/health")
 def health():
     return {"status": "healthy"}
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# Index builds and backfills on large tables outlast the app's statement_timeout, so migrations lift it.
+# Locks are still waited for only this long, so a deploy fails instead of hanging behind live traffic.
+MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv("MIGRATION_LOCK_TIMEOUT_MS", "60000"))
+
+def relax_timeouts(conn):
+    """Lift the pool's per-connection timeouts (database.py) for the rest of this transaction."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        conn.execute(text(f"SET LOCAL lock_timeout = {MIGRATION_LOCK_TIMEOUT_MS}"))
+
+def _has_column(conn, table, column):
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+def _add_column(conn, table, column, ddl):
+    if not _has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def _create_index(conn, name, table, columns):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+def _content_hash_and_cache_bypass(conn):
+    _add_column(conn, "invoices", "content_hash", "VARCHAR(64)")
+    _create_index(conn, "ix_invoices_content_hash", "invoices", "content_hash")
+    _add_column(conn, "extraction_jobs", "bypass_cache", "BOOLEAN DEFAULT FALSE")
+
+def _job_batches(conn):
+    _add_column(conn, "extraction_jobs", "batch_id", "INTEGER REFERENCES extraction_batches(id)")
+    _create_index(conn, "ix_extraction_jobs_batch_id", "extraction_jobs", "batch_id")
+
+def _extracted_field_columns(conn):
+    from .services.fields import to_columns
+
+    for column, ddl in (
+        ("customer_name", "VARCHAR"),
+        ("customer_tin", "VARCHAR"),
+        ("invoice_number", "VARCHAR"),
+        ("invoice_date", "DATE"),
+        ("untaxed_amount", "FLOAT"),
+        ("total_tax", "FLOAT"),
+        ("invoice_total", "FLOAT"),
+        ("company_name", "VARCHAR"),
+        ("company_address", "VARCHAR"),
+        ("company_tin", "VARCHAR"),
+    ):
+        _add_column(conn, "invoices", column, ddl)
+    for column in ("customer_tin", "invoice_number", "invoice_date", "invoice_total", "company_tin"):
+        _create_index(conn, f"ix_invoices_{column}", "invoices", column)
+
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, extracted_data FROM invoices WHERE extracted_data IS NOT NULL AND id > :last_id "
+            "ORDER BY id LIMIT 1000"
+        ), {"last_id": last_id}).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for invoice_id, extracted_data in rows:
+            try:
+                data = json.loads(extracted_data)
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                updates.append({"id": invoice_id, **to_columns(data)})
+        if updates:
+            conn.execute(text(
+                "UPDATE invoices SET customer_name = :customer_name, customer_tin = :customer_tin, "
+                "invoice_number = :invoice_number, invoice_date = :invoice_date, untaxed_amount = :untaxed_amount, "
+                "total_tax = :total_tax, invoice_total = :invoice_total, company_name = :company_name, "
+                "company_address = :company_address, company_tin = :company_tin WHERE id = :id"
+            ), updates)
+
+def _invoice_list_indexes(conn):
+    _create_index(conn, "ix_invoices_owner_created", "invoices", "owner_id, created_at, id")
+    _create_index(conn, "ix_invoices_owner_status_created", "invoices", "owner_id, status, created_at, id")
+    _create_index(conn, "ix_invoices_owner_invoice_date", "invoices", "owner_id, invoice_date")
+    _create_index(conn, "ix_invoices_owner_invoice_total", "invoices", "owner_id, invoice_total")
+    _create_index(conn, "ix_invoices_owner_customer_name", "invoices", "owner_id, customer_name")
+
+def _invoice_monthly_stats(conn):
+    from sqlalchemy.orm import Session
+    from . import models
+    from .services import stats
+
+    models.InvoiceMonthlyStats.__table__.create(conn, checkfirst=True)
+    with Session(bind=conn) as session:
+        stats.rebuild(session)
+
+def _user_settings_base_url(conn):
+    _add_column(conn, "user_settings", "base_url", "VARCHAR")
+
+def _job_queue_indexes(conn):
+    _create_index(conn, "ix_extraction_jobs_status_run_after", "extraction_jobs", "status, run_after, id")
+    _create_index(conn, "ix_extraction_jobs_status_locked", "extraction_jobs", "status, locked_at")
+    _create_index(conn, "ix_extraction_jobs_owner_status", "extraction_jobs", "owner_id, status")
+    _create_index(conn, "ix_extraction_jobs_invoice_status", "extraction_jobs", "invoice_id, status")
+
+def _invoice_events(conn):
+    from . import models
+
+    models.InvoiceEvent.__table__.create(conn, checkfirst=True)
+
+def _stored_blobs(conn):
+    from . import models
+
+    models.StoredBlob.__table__.create(conn, checkfirst=True)
+
+def _invoice_change_versions(conn):
+    from . import models
+
+    models.InvoiceChangeVersion.__table__.create(conn, checkfirst=True)
+
+# Append only: each entry runs once per database, in order.
+MIGRATIONS = [
+    (1, "content_hash_and_cache_bypass", _content_hash_and_cache_bypass),
+    (2, "job_batches", _job_batches),
+    (3, "extracted_field_columns", _extracted_field_columns),
+    (4, "invoice_list_indexes", _invoice_list_indexes),
+    (5, "invoice_monthly_stats", _invoice_monthly_stats),
+    (6, "user_settings_base_url", _user_settings_base_url),
+    (7, "job_queue_indexes", _job_queue_indexes),
+    (8, "invoice_events", _invoice_events),
+    (9, "stored_blobs", _stored_blobs),
+    (10, "invoice_change_versions", _invoice_change_versions),
+]
+
+def run_migrations(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            relax_timeouts(conn)
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow()}
+            )
+        logger.info("Applied migration %s_%s", version, name)
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, Boolean, UniqueConstraint, Index
+from sqlalchemy.orm import relationship, column_property
 from datetime import datetime
 from app.database import Base
 
@@ -24,21 +24,139 @@ class UserSettings(Base):
     deepseek_api_key = Column(String, nullable=True)
     openai_api_key = Column(String, nullable=True)
     default_model = Column(String, default="deepseek-chat")
+    base_url = Column(String, nullable=True)  # OpenAI-compatible endpoint overriding the provider default
     
     user = relationship("User", back_populates="settings")
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    __table_args__ = (
+        Index("ix_invoices_owner_created", "owner_id", "created_at", "id"),
+        Index("ix_invoices_owner_status_created", "owner_id", "status", "created_at", "id"),
+        Index("ix_invoices_owner_invoice_date", "owner_id", "invoice_date"),
+        Index("ix_invoices_owner_invoice_total", "owner_id", "invoice_total"),
+        Index("ix_invoices_owner_customer_name", "owner_id", "customer_name"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String)
     filepath = Column(String)
-    extracted_data = Column(Text)  # JSON string
-    status = Column(String, default="pending")  # pending, processing, completed, failed
-    confidence = Column(Float, default=0.0)
+    content_hash = Column(String(64), index=True, nullable=True)  # SHA-256 of the uploaded bytes
+    extracted_data = Column(Text)  # JSON string, as returned by the extractor
+    customer_name = Column(String, nullable=True)
+    customer_tin = Column(String, index=True, nullable=True)
+    invoice_number = Column(String, index=True, nullable=True)
+    invoice_date = Column(Date, index=True, nullable=True)
+    untaxed_amount = Column(Float, nullable=True)
+    total_tax = Column(Float, nullable=True)
+    invoice_total = Column(Float, index=True, nullable=True)
+    company_name = Column(String, nullable=True)
+    company_address = Column(String, nullable=True)
+    company_tin = Column(String, index=True, nullable=True)
+    # active_history keeps the previous value around for the stats rollup, even on expired instances
+    status = column_property(Column(String, default="pending"), active_history=True)  # pending, processing, completed, failed
+    confidence = column_property(Column(Float, default=0.0), active_history=True)
     error_message = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="invoices")
+    jobs = relationship("ExtractionJob", back_populates="invoice", cascade="all, delete-orphan")
+
+class ExtractionJob(Base):
+    __tablename__ = "extraction_jobs"
+    __table_args__ = (
+        Index("ix_extraction_jobs_status_run_after", "status", "run_after", "id"),
+        Index("ix_extraction_jobs_status_locked", "status", "locked_at"),
+        Index("ix_extraction_jobs_owner_status", "owner_id", "status"),
+        Index("ix_extraction_jobs_invoice_status", "invoice_id", "status"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    batch_id = Column(Integer, ForeignKey("extraction_batches.id"), index=True, nullable=True)
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    bypass_cache = Column(Boolean, default=False)
+    run_after = Column(DateTime, default=datetime.utcnow, index=True)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    invoice = relationship("Invoice", back_populates="jobs")
+    batch = relationship("ExtractionBatch", back_populates="jobs")
+
+class ExtractionBatch(Base):
+    __tablename__ = "extraction_batches"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    jobs = relationship("ExtractionJob", back_populates="batch")
+
+class ExtractionCache(Base):
+    __tablename__ = "extraction_cache"
+    __table_args__ = (
+        UniqueConstraint("content_hash", "provider", "model", "prompt_version", name="uq_extraction_cache_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), index=True)
+    provider = Column(String)
+    model = Column(String)
+    prompt_version = Column(String)
+    extracted_data = Column(Text)  # JSON string
+    confidence = Column(Float, default=0.0)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class InvoiceMonthlyStats(Base):
+    __tablename__ = "invoice_monthly_stats"
+    __table_args__ = (
+        UniqueConstraint("owner_id", "month", name="uq_invoice_monthly_stats_owner_month"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    month = Column(String(7))  # YYYY-MM, from Invoice.created_at
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    confidence_sum = Column(Float, default=0.0)  # over completed invoices
+
+class InvoiceEvent(Base):
+    __tablename__ = "invoice_events"
+    __table_args__ = (
+        Index("ix_invoice_events_owner_id_id", "owner_id", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"))
+    event_type = Column(String)  # invoice, invoice_deleted, batch
+    payload = Column(Text)  # JSON string, sent as the event data
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class StoredBlob(Base):
+    __tablename__ = "stored_blobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True)  # <h[:2]>/<h[2:4]>/<sha256><ext>, see services/blobs.py
+    content_hash = Column(String(64), index=True)
+    size = Column(Integer, nullable=True)
+    refcount = Column(Integer, default=0)  # invoices whose filepath is blob:<key>
+    created_at = Column(DateTime, default=datetime.utcnow)
+    released_at = Column(DateTime, nullable=True, index=True)  # when refcount last dropped to zero
+
+class InvoiceChangeVersion(Base):
+    __tablename__ = "invoice_change_versions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), unique=True, index=True)
+    version = Column(Integer, default=0)  # bumped by every flush that adds, changes or deletes the owner's invoices
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,55 @@
+"""One-off setup before any API worker starts: tables, migrations and the storage directory.
+
+Run once per deploy with `python -m app.prestart` (the Dockerfile does this before starting gunicorn),
+so workers never race each other on schema changes.
+"""
+import contextlib
+import logging
+import os
+
+from sqlalchemy import text
+
+from . import models
+from .database import engine
+from .migrations import relax_timeouts, run_migrations
+from .services import blobs
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK_ID = 7241003  # any constant shared by every replica
+
+@contextlib.contextmanager
+def _migration_lock():
+    # Replicas deploying together on Postgres take turns; SQLite serializes writers on its own.
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SET lock_timeout = 0"))
+        conn.execute(text("SET statement_timeout = 0"))
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            conn.execute(text("RESET lock_timeout"))
+            conn.execute(text("RESET statement_timeout"))
+
+def setup():
+    with _migration_lock():
+        with engine.begin() as conn:
+            relax_timeouts(conn)
+            models.Base.metadata.create_all(bind=conn)
+        run_migrations(engine)
+    if blobs.STORAGE_BACKEND == "local":
+        os.makedirs(blobs.STORAGE_TMP_DIR, exist_ok=True)
+    # Connections opened here must not leak into processes forked afterwards.
+    engine.dispose()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    setup()
+    logger.info("Database schema and storage are ready")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
@@ -7,15 +8,12 @@ from ..schemas import UserCreate, UserLogin, Token, UserResponse
 
 router = APIRouter()
 
-@router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(
+def _is_registered(db: Session, user: UserCreate) -> bool:
+    return db.query(models.User.id).filter(
         (models.User.email == user.email) | (models.User.username == user.username)
-    ).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Username or email already registered")
-    
-    hashed_password = auth.get_password_hash(user.password)
+    ).first() is not None
+
+def _create_user(db: Session, user: UserCreate, hashed_password: str):
     new_user = models.User(
         email=user.email,
         username=user.username,
@@ -26,9 +24,18 @@ def register(user: UserCreate, db: Session = Depends(database.get_db)):
     db.refresh(new_user)
     return new_user
 
+@router.post("/register", response_model=UserResponse)
+async def register(user: UserCreate, db: Session = Depends(database.get_db)):
+    # Async only to await the bcrypt pool; the database work runs in the threadpool.
+    if await run_in_threadpool(_is_registered, db, user):
+        raise HTTPException(status_code=400, detail="Username or email already registered")
+    
+    hashed_password = await auth.get_password_hash_async(user.password)
+    return await run_in_threadpool(_create_user, db, user, hashed_password)
+
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+    user = await auth.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -37,7 +44,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         )
     access_token_expires = timedelta(minutes=30)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=auth.token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
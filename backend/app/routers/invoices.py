@@ -1,103 +1,212 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import or_, tuple_
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import base64
+import logging
 import json
+import orjson
 import io
 import csv
-import os
-from datetime import datetime
+from datetime import date, datetime
 from .. import models, database, auth
-from ..schemas import InvoiceResponse, InvoiceListResponse, ExtractedData
+from ..schemas import InvoiceResponse, InvoiceListResponse, JobResponse, BatchProcessRequest, BatchResponse
+from ..services import jobs, events, httpcache, metrics, storage
+from ..services.xlsx import stream_xlsx
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 ALLOWED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tiff"}
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
 def allowed_file(filename: str):
     return any(filename.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS)
 
+# Only the columns each response carries; the rows are serialized with orjson as they come back from the
+# database, since response_model would just validate the same values a second time.
+LIST_COLUMNS = tuple(getattr(models.Invoice, name) for name in InvoiceListResponse.model_fields)
+DETAIL_COLUMNS = tuple(getattr(models.Invoice, name) for name in InvoiceResponse.model_fields)
+
+def encode_cursor(created_at: datetime, invoice_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{invoice_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, invoice_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(invoice_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
 @router.post("/upload")
 async def upload_invoices(
     files: List[UploadFile] = File(...),
+    process: bool = Form(False),
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    results = []
-    for file in files:
+    # Each file is validated and stored on its own, so a bad file only fails itself. The invoices for the
+    # rest are then written together: one flush (a single multi-row INSERT ... RETURNING where the database
+    # supports it) and one commit, so either all of them exist afterwards or none do.
+    results = [None] * len(files)
+    accepted = []
+    for index, file in enumerate(files):
         if not allowed_file(file.filename):
-            results.append({"filename": file.filename, "status": "failed", "error": "Invalid file type"})
+            metrics.uploads_rejected.inc(reason="type")
+            results[index] = {"filename": file.filename, "status": "failed", "error": "Invalid file type"}
+            continue
+        accepted.append((index, file))
+
+    stored = await storage.store_uploads([file for _, file in accepted])
+    pending = []
+    for (index, file), outcome in zip(accepted, stored):
+        if isinstance(outcome, storage.UploadError):
+            results[index] = {"filename": file.filename, "status": "failed", "error": str(outcome)}
             continue
-        
-        filepath = f"{UPLOAD_DIR}/{current_user.id}_{datetime.now().timestamp()}_{file.filename}"
-        with open(filepath, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        invoice = models.Invoice(
+        filepath, content_hash = outcome
+        pending.append((index, file.filename, models.Invoice(
             filename=file.filename,
             filepath=filepath,
+            content_hash=content_hash,
             owner_id=current_user.id,
-            status="processing"
-        )
-        db.add(invoice)
-        db.commit()
-        db.refresh(invoice)
-        results.append({"id": invoice.id, "filename": file.filename, "status": "uploaded"})
-    
+            status="pending"
+        )))
+
+    if not pending:
+        return {"results": results}
+    saved = await run_in_threadpool(save_uploads, db, current_user.id, [invoice for _, _, invoice in pending], process)
+    if saved is None:
+        # The stored blobs stay unreferenced and are reclaimed by garbage collection.
+        for index, filename, _ in pending:
+            results[index] = {"filename": filename, "status": "failed", "error": "Could not save invoice"}
+        return {"results": results}
+
+    ids, batch_id = saved
+    for (index, filename, _), invoice_id in zip(pending, ids):
+        results[index] = {"id": invoice_id, "filename": filename, "status": "uploaded"}
+    if batch_id is not None:
+        return {"results": results, "batch_id": batch_id}
     return {"results": results}
 
+def save_uploads(db: Session, owner_id: int, uploaded, process: bool):
+    """Insert the uploaded invoices (and their batch) in one transaction; (ids, batch id), or None if it failed."""
+    try:
+        db.add_all(uploaded)
+        db.flush()
+        ids = [invoice.id for invoice in uploaded]
+        batch_id = jobs.create_batch(db, owner_id, uploaded).id if process else None
+        if not process:
+            db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        logger.exception("Saving %d uploaded invoices failed", len(uploaded))
+        return None
+    return ids, batch_id
+
 @router.get("", response_model=List[InvoiceListResponse])
 def get_invoices(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    status: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    customer: Optional[str] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    q: Optional[str] = None,
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    invoices = db.query(models.Invoice).filter(models.Invoice.owner_id == current_user.id).order_by(models.Invoice.created_at.desc()).all()
-    results = []
-    for inv in invoices:
-        data = json.loads(inv.extracted_data) if inv.extracted_data else {}
-        results.append(InvoiceListResponse(
-            id=inv.id,
-            filename=inv.filename,
-            status=inv.status,
-            confidence=inv.confidence,
-            invoice_number=data.get("invoice_number"),
-            customer_name=data.get("customer_name"),
-            created_at=inv.created_at
+    # Read before the rows: a change committed in between then only makes the tag older than the page.
+    version, changed_at = httpcache.owner_version(db, current_user.id)
+    etag = httpcache.make_etag("invoices", current_user.id, version, sorted(request.query_params.multi_items()))
+    unchanged = httpcache.not_modified(request, etag, changed_at)
+    if unchanged is not None:
+        return unchanged
+
+    query = db.query(*LIST_COLUMNS).filter(models.Invoice.owner_id == current_user.id)
+    if status:
+        query = query.filter(models.Invoice.status == status)
+    if date_from:
+        query = query.filter(models.Invoice.invoice_date >= date_from)
+    if date_to:
+        query = query.filter(models.Invoice.invoice_date <= date_to)
+    if customer:
+        query = query.filter(or_(
+            models.Invoice.customer_name.ilike(like_pattern(customer), escape="\\"),
+            models.Invoice.customer_tin == customer
         ))
-    return results
+    if min_total is not None:
+        query = query.filter(models.Invoice.invoice_total >= min_total)
+    if max_total is not None:
+        query = query.filter(models.Invoice.invoice_total <= max_total)
+    if q:
+        query = query.filter(or_(
+            models.Invoice.invoice_number.ilike(like_pattern(q), escape="\\"),
+            models.Invoice.customer_name.ilike(like_pattern(q), escape="\\")
+        ))
+
+    key = tuple_(models.Invoice.created_at, models.Invoice.id)
+    if cursor:
+        position = decode_cursor(cursor)
+        query = query.filter(key < position if order == "desc" else key > position)
+    if order == "desc":
+        query = query.order_by(models.Invoice.created_at.desc(), models.Invoice.id.desc())
+    else:
+        query = query.order_by(models.Invoice.created_at.asc(), models.Invoice.id.asc())
+
+    rows = query.limit(limit + 1).all()
+    headers = httpcache.validator_headers(etag, changed_at)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return ORJSONResponse([row._asdict() for row in rows], headers=headers)
+
+@router.get("/events")
+async def invoice_events(
+    request: Request,
+    last_event_id: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_stream_user)
+):
+    # Browsers send Last-Event-ID themselves when EventSource reconnects; the query parameter covers first loads.
+    resume = request.headers.get("last-event-id") or last_event_id
+    return StreamingResponse(
+        events.stream(current_user.id, resume),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/{invoice_id}", response_model=InvoiceResponse)
 def get_invoice(
     invoice_id: int,
+    request: Request,
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    invoice = db.query(models.Invoice).filter(
+    row = db.query(*DETAIL_COLUMNS).filter(
         models.Invoice.id == invoice_id,
         models.Invoice.owner_id == current_user.id
     ).first()
-    if not invoice:
+    if row is None:
         raise HTTPException(status_code=404, detail="Invoice not found")
+    etag = httpcache.make_etag("invoice", row.id, row.updated_at)
+    unchanged = httpcache.not_modified(request, etag, row.updated_at)
+    if unchanged is not None:
+        return unchanged
     
-    extracted_data = None
-    if invoice.extracted_data:
-        extracted_data = json.loads(invoice.extracted_data)
-        extracted_data = ExtractedData(**extracted_data)
-    
-    return InvoiceResponse(
-        id=invoice.id,
-        filename=invoice.filename,
-        extracted_data=extracted_data,
-        status=invoice.status,
-        confidence=invoice.confidence,
-        error_message=invoice.error_message,
-        created_at=invoice.created_at,
-        updated_at=invoice.updated_at
-    )
+    invoice = row._asdict()
+    # Stored as a JSON object by the extractor (and sent as-is in invoice events); embedded without a decode.
+    invoice["extracted_data"] = orjson.Fragment(invoice["extracted_data"]) if invoice["extracted_data"] else None
+    return ORJSONResponse(invoice, headers=httpcache.validator_headers(etag, row.updated_at))
 
 @router.delete("/{invoice_id}")
 def delete_invoice(
@@ -116,54 +225,120 @@ def delete_invoice(
     db.commit()
     return {"message": "Invoice deleted"}
 
-@router.get("/export/csv")
-def export_csv(
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
-):
-    invoices = db.query(models.Invoice).filter(
-        models.Invoice.owner_id == current_user.id,
-        models.Invoice.status == "completed"
-    ).all()
-    
+EXPORT_HEADER = ["Customer Name", "Customer TIN", "Invoice Number", "Date", 
+                 "Untaxed Amount", "Total Tax", "Total", "Company Name", 
+                 "Company Address", "Company TIN", "Confidence", "Filename"]
+
+EXPORT_COLUMNS = (
+    models.Invoice.id,
+    models.Invoice.customer_name,
+    models.Invoice.customer_tin,
+    models.Invoice.invoice_number,
+    models.Invoice.invoice_date,
+    models.Invoice.untaxed_amount,
+    models.Invoice.total_tax,
+    models.Invoice.invoice_total,
+    models.Invoice.company_name,
+    models.Invoice.company_address,
+    models.Invoice.company_tin,
+    models.Invoice.confidence,
+    models.Invoice.filename,
+    models.Invoice.status,
+)
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+EXPORT_BATCH_SIZE = 1000
+
+def export_rows(owner_id: int, status: Optional[str], date_from: Optional[date], date_to: Optional[date]):
+    # The request-scoped session is closed before the response body is sent, so the stream owns its own.
+    db = database.SessionLocal()
+    try:
+        query = db.query(*EXPORT_COLUMNS).filter(models.Invoice.owner_id == owner_id)
+        if status:
+            query = query.filter(models.Invoice.status == status)
+        if date_from:
+            query = query.filter(models.Invoice.invoice_date >= date_from)
+        if date_to:
+            query = query.filter(models.Invoice.invoice_date <= date_to)
+        query = query.order_by(models.Invoice.created_at, models.Invoice.id)
+        for row in query.execution_options(yield_per=EXPORT_BATCH_SIZE):
+            yield row
+    finally:
+        db.close()
+
+def table_row(row):
+    return [
+        row.customer_name,
+        row.customer_tin,
+        row.invoice_number,
+        row.invoice_date.isoformat() if row.invoice_date else None,
+        row.untaxed_amount,
+        row.total_tax,
+        row.invoice_total,
+        row.company_name,
+        row.company_address,
+        row.company_tin,
+    ]
+
+def stream_csv(rows):
     output = io.StringIO()
     writer = csv.writer(output)
-    writer.writerow(["Customer Name", "Customer TIN", "Invoice Number", "Date", 
-                     "Untaxed Amount", "Total Tax", "Total", "Company Name", 
-                     "Company Address", "Company TIN", "Confidence", "Filename"])
-    
-    for inv in invoices:
-        data = json.loads(inv.extracted_data) if inv.extracted_data else {}
-        writer.writerow([
-            data.get("customer_name", ""),
-            data.get("customer_tin", ""),
-            data.get("invoice_number", ""),
-            data.get("invoice_date", ""),
-            data.get("untaxed_amount", ""),
-            data.get("total_tax", ""),
-            data.get("invoice_total", ""),
-            data.get("company_name", ""),
-            data.get("company_address", ""),
-            data.get("company_tin", ""),
-            f"{inv.confidence * 100:.1f}%",
-            inv.filename
-        ])
+    writer.writerow(EXPORT_HEADER)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(["" if value is None else value for value in table_row(row)]
+                        + [f"{(row.confidence or 0) * 100:.1f}%", row.filename])
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield output.getvalue().encode()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue().encode()
+
+def stream_ndjson(rows):
+    for row in rows:
+        record = dict(row._mapping)
+        record["invoice_date"] = row.invoice_date.isoformat() if row.invoice_date else None
+        yield (json.dumps(record) + "\n").encode()
+
+@router.get("/export/{fmt}")
+def export_invoices(
+    fmt: str,
+    status: Optional[str] = "completed",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="Unsupported export format")
     
-    output.seek(0)
+    rows = export_rows(current_user.id, status, date_from, date_to)
+    if fmt == "csv":
+        body = stream_csv(rows)
+    elif fmt == "ndjson":
+        body = stream_ndjson(rows)
+    else:
+        body = stream_xlsx(
+            EXPORT_HEADER,
+            (table_row(row) + [row.confidence, row.filename] for row in rows),
+            sheet_name="Invoices"
+        )
     return StreamingResponse(
-        io.BytesIO(output.getvalue().encode()),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=invoices.csv"}
+        body,
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=invoices.{fmt}"}
     )
 
-@router.post("/process/{invoice_id}")
-async def process_invoice(
+@router.post("/process/{invoice_id}", status_code=202)
+def process_invoice(
     invoice_id: int,
+    bypass_cache: bool = False,
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    from ..services.extractor import extract_invoice_data
-    
     invoice = db.query(models.Invoice).filter(
         models.Invoice.id == invoice_id,
         models.Invoice.owner_id == current_user.id
@@ -171,16 +346,54 @@ async def process_invoice(
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    try:
-        result = await extract_invoice_data(invoice.filepath)
-        invoice.extracted_data = json.dumps(result["data"])
-        invoice.status = "completed"
-        invoice.confidence = result["confidence"]
-        invoice.updated_at = datetime.utcnow()
-        db.commit()
-        return {"status": "completed", "data": result["data"], "confidence": result["confidence"]}
-    except Exception as e:
-        invoice.status = "failed"
-        invoice.error_message = str(e)
-        db.commit()
-        return {"status": "failed", "error": str(e)}
+    job = jobs.enqueue(db, invoice, bypass_cache=bypass_cache)
+    return {"job_id": job.id, "invoice_id": invoice.id, "status": invoice.status}
+
+@router.post("/process", status_code=202)
+def process_invoices(
+    request: BatchProcessRequest,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    query = db.query(models.Invoice).filter(models.Invoice.owner_id == current_user.id)
+    if request.all_pending:
+        query = query.filter(models.Invoice.status == "pending")
+    elif request.invoice_ids:
+        query = query.filter(models.Invoice.id.in_(request.invoice_ids))
+    else:
+        raise HTTPException(status_code=400, detail="Provide invoice_ids or set all_pending")
+    
+    invoices = query.order_by(models.Invoice.id).all()
+    if not invoices:
+        raise HTTPException(status_code=404, detail="No matching invoices")
+    
+    batch = jobs.create_batch(db, current_user.id, invoices, bypass_cache=request.bypass_cache)
+    return {"batch_id": batch.id, "total": len(invoices)}
+
+@router.get("/batches/{batch_id}", response_model=BatchResponse)
+def get_batch(
+    batch_id: int,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    batch = db.query(models.ExtractionBatch).filter(
+        models.ExtractionBatch.id == batch_id,
+        models.ExtractionBatch.owner_id == current_user.id
+    ).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return jobs.batch_progress(db, batch)
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(
+    job_id: int,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    job = db.query(models.ExtractionJob).filter(
+        models.ExtractionJob.id == job_id,
+        models.ExtractionJob.owner_id == current_user.id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -8,12 +8,14 @@ router = APIRouter()
 class SettingsResponse(BaseModel):
     ai_provider: str
     default_model: str
+    base_url: str | None = None
 
 class SettingsUpdate(BaseModel):
     ai_provider: str = "deepseek"
     deepseek_api_key: str | None = None
     openai_api_key: str | None = None
     default_model: str = "deepseek-chat"
+    base_url: str | None = None
 
 @router.get("/settings", response_model=SettingsResponse)
 def get_settings(
@@ -36,7 +38,8 @@ def get_settings(
     
     return {
         "ai_provider": settings.ai_provider,
-        "default_model": settings.default_model
+        "default_model": settings.default_model,
+        "base_url": settings.base_url
     }
 
 @router.put("/settings")
@@ -55,6 +58,7 @@ def update_settings(
     
     user_settings.ai_provider = settings.ai_provider
     user_settings.default_model = settings.default_model
+    user_settings.base_url = settings.base_url or None
     
     if settings.deepseek_api_key:
         user_settings.deepseek_api_key = settings.deepseek_api_key
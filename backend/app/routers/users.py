@@ -1,58 +1,28 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from datetime import datetime, timedelta
+from datetime import datetime
 from .. import models, database, auth
 from ..schemas import StatsResponse
+from ..services import httpcache, stats
 
 router = APIRouter()
 
 @router.get("/stats", response_model=StatsResponse)
 def get_stats(
+    request: Request,
+    response: Response,
+    months: int = Query(6, ge=1, le=120),
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    total_invoices = db.query(func.count(models.Invoice.id)).filter(
-        models.Invoice.owner_id == current_user.id
-    ).scalar() or 0
-    
-    completed_invoices = db.query(func.count(models.Invoice.id)).filter(
-        models.Invoice.owner_id == current_user.id,
-        models.Invoice.status == "completed"
-    ).scalar() or 0
-    
-    failed_invoices = db.query(func.count(models.Invoice.id)).filter(
-        models.Invoice.owner_id == current_user.id,
-        models.Invoice.status == "failed"
-    ).scalar() or 0
-    
-    avg_confidence = db.query(func.avg(models.Invoice.confidence)).filter(
-        models.Invoice.owner_id == current_user.id,
-        models.Invoice.status == "completed"
-    ).scalar() or 0
-    
-    success_rate = (completed_invoices / total_invoices * 100) if total_invoices > 0 else 0
-    
-    monthly_data = []
-    for i in range(6):
-        month_start = datetime.utcnow().replace(day=1) - timedelta(days=i*30)
-        month_end = month_start + timedelta(days=30)
-        count = db.query(func.count(models.Invoice.id)).filter(
-            models.Invoice.owner_id == current_user.id,
-            models.Invoice.created_at >= month_start,
-            models.Invoice.created_at < month_end
-        ).scalar() or 0
-        monthly_data.append({
-            "month": month_start.strftime("%Y-%m"),
-            "count": count
-        })
-    monthly_data.reverse()
-    
-    return StatsResponse(
-        total_invoices=total_invoices,
-        completed_invoices=completed_invoices,
-        failed_invoices=failed_invoices,
-        average_confidence=round(avg_confidence, 2),
-        success_rate=round(success_rate, 1),
-        monthly_data=monthly_data
-    )
+    version, changed_at = httpcache.owner_version(db, current_user.id)
+    # The monthly series ends at the current month, so it changes when the month does.
+    now = datetime.utcnow()
+    etag = httpcache.make_etag("stats", current_user.id, version, months, stats.month_key(now))
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    last_modified = max(changed_at, month_start) if changed_at else month_start
+    unchanged = httpcache.not_modified(request, etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    response.headers.update(httpcache.validator_headers(etag, last_modified))
+    return stats.summary(db, current_user.id, months)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime
+from typing import Optional, List
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -62,11 +62,51 @@ class InvoiceListResponse(BaseModel):
     confidence: float
     invoice_number: Optional[str] = None
     customer_name: Optional[str] = None
+    invoice_date: Optional[date] = None
+    invoice_total: Optional[float] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class JobResponse(BaseModel):
+    id: int
+    invoice_id: int
+    status: str
+    attempts: int
+    max_attempts: int
+    run_after: datetime
+    last_error: Optional[str] = None
     created_at: datetime
+    updated_at: datetime
     
     class Config:
         from_attributes = True
 
+class BatchProcessRequest(BaseModel):
+    invoice_ids: Optional[List[int]] = None
+    all_pending: bool = False
+    bypass_cache: bool = False
+
+class BatchItem(BaseModel):
+    job_id: int
+    invoice_id: int
+    filename: Optional[str] = None
+    status: str
+    attempts: int
+    error_message: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    id: int
+    total: int
+    pending: int
+    processing: int
+    completed: int
+    failed: int
+    finished: bool
+    created_at: datetime
+    items: List[BatchItem]
+
 class StatsResponse(BaseModel):
     total_invoices: int
     completed_invoices: int
@@ -0,0 +1,361 @@
+"""Content-addressed upload storage, referenced from Invoice.filepath as "blob:<key>".
+
+Keys are "<h[:2]>/<h[2:4]>/<sha256><ext>", so identical uploads share one object and no directory grows
+past a few hundred entries. stored_blobs counts invoices per key (kept in sync on flush, like the stats
+rollup); blobs nobody has referenced for STORAGE_GC_GRACE_SECONDS are reclaimed by collect_garbage().
+Older rows keep their plain "uploads/..." paths, which are read as-is and removed with their invoice.
+"""
+import asyncio
+import contextlib
+import os
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import case, event, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models, database
+from . import metrics, parsing
+
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local or s3
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "uploads/blobs")
+STORAGE_TMP_DIR = os.getenv("STORAGE_TMP_DIR", os.path.join(STORAGE_ROOT, ".tmp"))
+STORAGE_GC_GRACE_SECONDS = float(os.getenv("STORAGE_GC_GRACE_SECONDS", "3600"))
+STORAGE_GC_BATCH = int(os.getenv("STORAGE_GC_BATCH", "500"))
+STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET", "")
+STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "blobs/")
+STORAGE_S3_ENDPOINT_URL = os.getenv("STORAGE_S3_ENDPOINT_URL") or None  # e.g. a local MinIO for testing
+LEGACY_UPLOAD_DIR = "uploads"
+
+REFERENCE_PREFIX = "blob:"
+EXTENSION_ALIASES = {".jpeg": ".jpg", ".tif": ".tiff"}
+
+class LocalBackend:
+    def __init__(self, root: str):
+        self.root = root
+        self.trash_dir = os.path.join(root, ".trash")
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _trash_path(self, key: str) -> str:
+        return os.path.join(self.trash_dir, key.replace("/", "_"))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put(self, source: str, key: str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+
+    def trash(self, key: str) -> bool:
+        os.makedirs(self.trash_dir, exist_ok=True)
+        try:
+            os.replace(self.path(key), self._trash_path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def restore(self, key: str):
+        os.replace(self._trash_path(key), self.path(key))
+
+    def purge(self, key: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._trash_path(key))
+
+    @contextlib.contextmanager
+    def local_path(self, key: str):
+        yield self.path(key)
+
+class S3Backend:
+    """Any S3-compatible store; boto3 is only needed when this backend is selected."""
+
+    def __init__(self, bucket: str, prefix: str, endpoint_url: Optional[str] = None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires STORAGE_S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _object(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _trash_object(self, key: str) -> str:
+        return f"{self.prefix}.trash/{key}"
+
+    def _copy(self, source: str, dest: str):
+        self.client.copy_object(Bucket=self.bucket, Key=dest, CopySource={"Bucket": self.bucket, "Key": source})
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, source: str, key: str):
+        self.client.upload_file(source, self.bucket, self._object(key))
+        os.remove(source)
+
+    def trash(self, key: str) -> bool:
+        if not self.exists(key):
+            return False
+        self._copy(self._object(key), self._trash_object(key))
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+        return True
+
+    def restore(self, key: str):
+        self._copy(self._trash_object(key), self._object(key))
+        self.purge(key)
+
+    def purge(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._trash_object(key))
+
+    @contextlib.contextmanager
+    def local_path(self, key: str):
+        # Parsers need a real file to map; the copy lives only as long as the extraction.
+        os.makedirs(STORAGE_TMP_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=STORAGE_TMP_DIR, suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._object(key), path)
+            yield path
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "s3":
+            _backend = S3Backend(STORAGE_S3_BUCKET, STORAGE_S3_PREFIX, STORAGE_S3_ENDPOINT_URL)
+        else:
+            _backend = LocalBackend(STORAGE_ROOT)
+    return _backend
+
+def blob_key(content_hash: str, ext: str) -> str:
+    ext = EXTENSION_ALIASES.get(ext.lower(), ext.lower())
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{ext}"
+
+def reference(key: str) -> str:
+    return f"{REFERENCE_PREFIX}{key}"
+
+def key_of(filepath: Optional[str]) -> Optional[str]:
+    if filepath and filepath.startswith(REFERENCE_PREFIX):
+        return filepath[len(REFERENCE_PREFIX):]
+    return None
+
+def temp_path(ext: str = "") -> str:
+    os.makedirs(STORAGE_TMP_DIR, exist_ok=True)
+    return os.path.join(STORAGE_TMP_DIR, f"{uuid.uuid4().hex}{ext}")
+
+@contextlib.asynccontextmanager
+async def local_path(filepath: str):
+    """A filesystem path for an invoice file, fetching it from a remote backend if needed."""
+    key = key_of(filepath)
+    if key is None:
+        yield filepath
+        return
+    manager = get_backend().local_path(key)
+    path = await asyncio.to_thread(manager.__enter__)
+    try:
+        yield path
+    finally:
+        await asyncio.to_thread(manager.__exit__, None, None, None)
+
+def _register(blobs: dict) -> dict:
+    """Register keys ({key: (content_hash, size)}) in one transaction; returns the live refcount of each."""
+    table = models.StoredBlob.__table__
+    for _ in range(2):
+        now = datetime.utcnow()
+        db = database.SessionLocal()
+        try:
+            db.execute(table.update().where(table.c.key.in_(blobs)).values(
+                released_at=case((table.c.refcount <= 0, now), else_=table.c.released_at)
+            ))
+            live = dict(db.query(models.StoredBlob.key, models.StoredBlob.refcount).filter(
+                models.StoredBlob.key.in_(blobs)
+            ).all())
+            missing = [key for key in blobs if key not in live]
+            if missing:
+                db.execute(table.insert(), [
+                    {"key": key, "content_hash": blobs[key][0], "size": blobs[key][1], "refcount": 0,
+                     "created_at": now, "released_at": now}
+                    for key in missing
+                ])
+            db.commit()
+            return live
+        except IntegrityError:
+            db.rollback()
+            # A concurrent upload of the same content inserted a row first; the retry updates it instead.
+        finally:
+            db.close()
+    return {}
+
+def store_many(items) -> list:
+    """Move fully written temp files, given as (source, key, content_hash, size), into the store.
+
+    Returns one entry per item: True when written, False when the object was already there, or the
+    exception that writing it raised. Every key is registered (and its grace period restarted) in one
+    transaction before any object is written, so GC cannot reclaim a key between this call and the
+    invoices that reference it being committed.
+    """
+    if not items:
+        return []
+    live = _register({key: (content_hash, size) for _, key, content_hash, size in items})
+    backend = get_backend()
+    outcomes = []
+    for source, key, _, _ in items:
+        try:
+            if live.get(key, 0) > 0 and backend.exists(key):
+                os.remove(source)
+                metrics.blob_store_events.inc(event="deduplicated")
+                outcomes.append(False)
+                continue
+            # Unreferenced keys are always rewritten: a collector may be trashing the old copy right now.
+            backend.put(source, key)
+            metrics.blob_store_events.inc(event="stored")
+            outcomes.append(True)
+        except Exception as e:
+            outcomes.append(e)
+    return outcomes
+
+def _filepath_history(state):
+    history = state.attrs.filepath.history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return state.obj().filepath
+
+def _adjust(session, deltas: dict):
+    # One statement for the whole flush, however many invoices a bulk upload added.
+    table = models.StoredBlob.__table__
+    now = datetime.utcnow()
+    refcount = table.c.refcount + case(deltas, value=table.c.key, else_=0)
+    updated = session.execute(table.update().where(table.c.key.in_(deltas)).values(
+        refcount=refcount,
+        released_at=case((refcount <= 0, now), else_=None)
+    )).rowcount
+    if updated < len(deltas):
+        existing = set(session.scalars(select(table.c.key).where(table.c.key.in_(deltas))))
+        missing = [key for key, delta in deltas.items() if key not in existing and delta > 0]
+        if missing:
+            session.execute(table.insert(), [
+                {"key": key, "content_hash": os.path.splitext(key.rsplit("/", 1)[-1])[0], "refcount": deltas[key],
+                 "created_at": now}
+                for key in missing
+            ])
+
+@event.listens_for(Session, "before_flush")
+def _track_references(session, flush_context, instances):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, models.Invoice) and key_of(obj.filepath):
+            deltas[key_of(obj.filepath)] += 1
+    for obj in session.dirty:
+        if isinstance(obj, models.Invoice):
+            state = inspect(obj)
+            if state.attrs.filepath.history.has_changes():
+                old = key_of(_filepath_history(state))
+                if old:
+                    deltas[old] -= 1
+                if key_of(obj.filepath):
+                    deltas[key_of(obj.filepath)] += 1
+    for obj in session.deleted:
+        if isinstance(obj, models.Invoice):
+            filepath = _filepath_history(inspect(obj))
+            if key_of(filepath):
+                deltas[key_of(filepath)] -= 1
+            elif filepath:
+                session.info.setdefault("released_files", []).append(filepath)
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if deltas:
+        _adjust(session, deltas)
+
+@event.listens_for(Session, "after_commit")
+def _remove_released_files(session):
+    # Pre-blob uploads belong to exactly one invoice, so the file goes with it.
+    root = os.path.realpath(LEGACY_UPLOAD_DIR)
+    for filepath in session.info.pop("released_files", ()):
+        if os.path.realpath(filepath).startswith(root + os.sep):
+            with contextlib.suppress(OSError):
+                os.remove(filepath)
+
+@event.listens_for(Session, "after_rollback")
+def _keep_released_files(session):
+    session.info.pop("released_files", None)
+
+def collect_garbage(limit: int = STORAGE_GC_BATCH) -> int:
+    """Reclaim blobs unreferenced for longer than the grace period; returns how many were removed."""
+    db = database.SessionLocal()
+    backend = get_backend()
+    reclaimed = 0
+    purged_hashes = set()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=STORAGE_GC_GRACE_SECONDS)
+        candidates = db.query(models.StoredBlob.id, models.StoredBlob.key, models.StoredBlob.content_hash).filter(
+            models.StoredBlob.refcount <= 0,
+            models.StoredBlob.released_at < cutoff
+        ).limit(limit).all()
+        for blob_id, key, content_hash in candidates:
+            deleted = db.query(models.StoredBlob).filter(
+                models.StoredBlob.id == blob_id,
+                models.StoredBlob.refcount <= 0,
+                models.StoredBlob.released_at < cutoff
+            ).delete(synchronize_session=False)
+            db.commit()
+            if not deleted:
+                continue
+            if not backend.trash(key):
+                continue
+            # An upload may have registered the key again after the row was deleted; it keeps the object.
+            revived = db.query(models.StoredBlob.id).filter(models.StoredBlob.key == key).first() is not None
+            db.rollback()
+            if revived:
+                backend.restore(key)
+            else:
+                backend.purge(key)
+                reclaimed += 1
+                purged_hashes.add(content_hash)
+
+        # Parsed text is cached per content hash, which another blob (same bytes, other extension) may share.
+        purged_hashes.discard(None)
+        if purged_hashes:
+            live = {row[0] for row in db.query(models.StoredBlob.content_hash).filter(
+                models.StoredBlob.content_hash.in_(purged_hashes)
+            )}
+            db.rollback()
+            for content_hash in purged_hashes - live:
+                parsing.forget_text(content_hash)
+    finally:
+        db.close()
+    if reclaimed:
+        metrics.blob_store_events.inc(reclaimed, event="reclaimed")
+    _remove_stale_temp_files()
+    return reclaimed
+
+def _remove_stale_temp_files():
+    cutoff = time.time() - STORAGE_GC_GRACE_SECONDS
+    with contextlib.suppress(FileNotFoundError):
+        for entry in os.scandir(STORAGE_TMP_DIR):
+            with contextlib.suppress(OSError):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
@@ -0,0 +1,77 @@
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from .. import models
+
+EXTRACTION_CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "50000"))
+
+counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def lookup(db, content_hash: str, provider: str, model: str, prompt_version: str) -> Optional[dict]:
+    cutoff = datetime.utcnow() - timedelta(seconds=EXTRACTION_CACHE_TTL_SECONDS)
+    entry = db.query(models.ExtractionCache).filter(
+        models.ExtractionCache.content_hash == content_hash,
+        models.ExtractionCache.provider == provider,
+        models.ExtractionCache.model == model,
+        models.ExtractionCache.prompt_version == prompt_version,
+        models.ExtractionCache.last_used_at >= cutoff
+    ).first()
+    if entry is None:
+        counters["misses"] += 1
+        return None
+
+    counters["hits"] += 1
+    entry.hits = (entry.hits or 0) + 1
+    entry.last_used_at = datetime.utcnow()
+    db.commit()
+    return {"data": json.loads(entry.extracted_data), "confidence": entry.confidence}
+
+def store(db, content_hash: str, provider: str, model: str, prompt_version: str, result: dict):
+    entry = db.query(models.ExtractionCache).filter(
+        models.ExtractionCache.content_hash == content_hash,
+        models.ExtractionCache.provider == provider,
+        models.ExtractionCache.model == model,
+        models.ExtractionCache.prompt_version == prompt_version
+    ).first()
+    if entry is None:
+        entry = models.ExtractionCache(
+            content_hash=content_hash,
+            provider=provider,
+            model=model,
+            prompt_version=prompt_version
+        )
+        db.add(entry)
+    entry.extracted_data = json.dumps(result["data"])
+    entry.confidence = result["confidence"]
+    entry.created_at = entry.last_used_at = datetime.utcnow()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker stored the same key first; its result is equivalent.
+        db.rollback()
+        return
+    counters["stores"] += 1
+
+def evict(db) -> int:
+    cutoff = datetime.utcnow() - timedelta(seconds=EXTRACTION_CACHE_TTL_SECONDS)
+    removed = db.query(models.ExtractionCache).filter(
+        models.ExtractionCache.last_used_at < cutoff
+    ).delete(synchronize_session=False)
+
+    overflow = db.query(models.ExtractionCache).count() - EXTRACTION_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        oldest = db.query(models.ExtractionCache.id).order_by(
+            models.ExtractionCache.last_used_at
+        ).limit(overflow).scalar_subquery()
+        removed += db.query(models.ExtractionCache).filter(
+            models.ExtractionCache.id.in_(oldest)
+        ).delete(synchronize_session=False)
+
+    db.commit()
+    counters["evictions"] += removed
+    return removed
@@ -0,0 +1,125 @@
+"""Response compression negotiated from Accept-Encoding: brotli when the Brotli package is installed, else gzip.
+
+Only JSON, CSV and other text bodies are compressed, and only from COMPRESSION_MIN_BYTES up. Event
+streams are left alone, since a compressor would hold events back until its buffer fills.
+"""
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))  # 11 is far slower for little gain on JSON
+
+COMPRESSIBLE_TYPES = {"application/json", "text/csv", "application/x-ndjson", "text/plain"}
+
+# A compressed body is a different representation, so its strong ETag gets a suffix (as Apache does).
+ETAG_SUFFIXES = ("-br", "-gzip")
+
+def negotiate(accept_encoding: str):
+    """The encoding to use for a request's Accept-Encoding header, or None for identity."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().lower().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if coding:
+            accepted[coding.strip()] = quality
+
+    def allowed(coding):
+        return accepted.get(coding, accepted.get("*", 0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+def _compressor(encoding: str):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    return compressor.compress, compressor.flush
+
+def _compressible(status: int, headers: Headers) -> bool:
+    if status < 200 or status in (204, 304) or "content-encoding" in headers:
+        return False
+    return headers.get("content-type", "").split(";")[0].strip() in COMPRESSIBLE_TYPES
+
+class CompressionMiddleware:
+    """ASGI middleware compressing eligible responses; streamed bodies are compressed chunk by chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None  # held back until the first body chunk shows whether compressing pays off
+        compress = finish = None
+
+        async def send_wrapper(message):
+            nonlocal start, compress, finish
+            if message["type"] == "http.response.start":
+                if _compressible(message["status"], Headers(raw=message["headers"])):
+                    MutableHeaders(scope=message).add_vary_header("Accept-Encoding")
+                    start = message
+                    return
+                await send(message)
+                return
+            if message["type"] != "http.response.body" or (start is None and compress is None):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compress is None:
+                if not more_body and len(body) < COMPRESSION_MIN_BYTES:
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                compress, finish = _compressor(encoding)
+                headers = MutableHeaders(scope=start)
+                headers["Content-Encoding"] = encoding
+                etag = headers.get("etag")
+                if etag and etag.endswith('"'):
+                    headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+                data = compress(body)
+                if more_body:
+                    del headers["content-length"]
+                else:
+                    data += finish()
+                    headers["Content-Length"] = str(len(data))
+                await send(start)
+                start = None
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+
+            data = compress(body)
+            if not more_body:
+                data += finish()
+            elif not data:
+                return  # still buffered in the compressor
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,368 @@
+"""Per-user stream of invoice status transitions, extraction results and batch progress.
+
+Changes are captured from each flush and published once the transaction commits. With EVENTS_BACKEND=memory
+they fan out to streams in this process only; with EVENTS_BACKEND=database they are written to invoice_events
+in the same transaction and every process polls that table, so streams see work done by any worker.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event, false, func, inspect, insert, or_, select
+from sqlalchemy.orm import Session
+
+from .. import models, database
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")  # memory or database
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "1000"))
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "5000"))
+EVENTS_REPLAY_LIMIT = int(os.getenv("EVENTS_REPLAY_LIMIT", "1000"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+# Streams end after this long and the browser reconnects with Last-Event-ID, which re-checks the token
+# and keeps a graceful shutdown from waiting on idle clients.
+EVENTS_MAX_STREAM_SECONDS = float(os.getenv("EVENTS_MAX_STREAM_SECONDS", "600"))
+EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "0.5"))
+EVENTS_RETENTION_SECONDS = float(os.getenv("EVENTS_RETENTION_SECONDS", "3600"))
+# Postgres can commit sequence ids out of order, so the poller re-reads this many ids behind its cursor.
+EVENTS_REORDER_WINDOW = int(os.getenv("EVENTS_REORDER_WINDOW", "100"))
+
+WATCHED_ATTRIBUTES = ("status", "confidence", "error_message")
+FETCH_LIMIT = 1000
+RESET = None
+
+def _new_epoch() -> str:
+    return f"{time.time_ns():x}.{os.getpid():x}"
+
+# Memory ids are "<epoch>-<seq>", so an id from before a restart is recognised and answered with a reset.
+# start() sets both again: with gunicorn's preload_app this module is imported once in the master, and
+# every worker forked from it would otherwise share one epoch while counting from 1 again.
+_EPOCH = _new_epoch()
+_seq = itertools.count(1)
+_recent = deque(maxlen=EVENTS_BUFFER_SIZE)
+_subscribers: dict = {}
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+_tasks: list = []
+
+class Event:
+    __slots__ = ("seq", "owner_id", "message")
+
+    def __init__(self, seq: int, owner_id: int, event_type: str, payload: str, event_id: str):
+        self.seq = seq
+        self.owner_id = owner_id
+        self.message = f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+class Subscription:
+    def __init__(self, owner_id: int):
+        self.owner_id = owner_id
+        self.queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # A client this far behind reloads through the REST API instead of holding more events in memory.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESET)
+            metrics.event_stream_resets.inc(reason="lagged")
+
+def subscribe(owner_id: int) -> Subscription:
+    subscription = Subscription(owner_id)
+    _subscribers.setdefault(owner_id, set()).add(subscription)
+    return subscription
+
+def unsubscribe(subscription: Subscription):
+    subscriptions = _subscribers.get(subscription.owner_id)
+    if subscriptions is not None:
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del _subscribers[subscription.owner_id]
+
+def _deliver(item: Event):
+    for subscription in _subscribers.get(item.owner_id, ()):
+        subscription.put(item)
+
+def _invoice_payload(invoice: models.Invoice) -> dict:
+    payload = {
+        "id": invoice.id,
+        "filename": invoice.filename,
+        "status": invoice.status,
+        "confidence": invoice.confidence,
+        "error_message": invoice.error_message,
+        "updated_at": invoice.updated_at.isoformat() if invoice.updated_at else None,
+    }
+    if invoice.status == "completed" and invoice.extracted_data:
+        payload["extracted_data"] = json.loads(invoice.extracted_data)
+    return payload
+
+def _batch_payloads(connection, invoice_ids, batch_ids):
+    job = models.ExtractionJob
+    condition = job.batch_id.in_(batch_ids) if batch_ids else false()
+    if invoice_ids:
+        # Claims update jobs in bulk, so the batch is found through the invoice rather than a dirty job.
+        condition = or_(condition, job.batch_id.in_(
+            select(job.batch_id).where(job.invoice_id.in_(invoice_ids), job.batch_id.isnot(None))
+        ))
+    rows = connection.execute(
+        select(job.batch_id, job.owner_id, models.Invoice.status, func.count())
+        .join(models.Invoice, models.Invoice.id == job.invoice_id)
+        .where(condition)
+        .group_by(job.batch_id, job.owner_id, models.Invoice.status)
+    ).all()
+
+    batches = {}
+    for batch_id, owner_id, status, count in rows:
+        _, counts = batches.setdefault(batch_id, (owner_id, {"pending": 0, "processing": 0, "completed": 0, "failed": 0}))
+        counts[status] = counts.get(status, 0) + count
+    payloads = []
+    for batch_id, (owner_id, counts) in batches.items():
+        total = sum(counts.values())
+        payloads.append((owner_id, "batch", {
+            "id": batch_id,
+            "total": total,
+            **counts,
+            "finished": counts["completed"] + counts["failed"] == total,
+        }))
+    return payloads
+
+@event.listens_for(Session, "after_flush")
+def _capture(session, flush_context):
+    # Without a running server nobody can be listening in memory mode (scripts, migrations).
+    if EVENTS_BACKEND != "database" and _loop is None:
+        return
+
+    captured = []
+    invoice_ids = set()
+    batch_ids = set()
+    for obj in session.new:
+        if isinstance(obj, models.Invoice):
+            captured.append((obj.owner_id, "invoice", _invoice_payload(obj)))
+        elif isinstance(obj, models.ExtractionJob) and obj.batch_id:
+            batch_ids.add(obj.batch_id)
+    for obj in session.dirty:
+        if isinstance(obj, models.Invoice):
+            state = inspect(obj)
+            if any(state.attrs[attr].history.has_changes() for attr in WATCHED_ATTRIBUTES):
+                captured.append((obj.owner_id, "invoice", _invoice_payload(obj)))
+                invoice_ids.add(obj.id)
+        elif isinstance(obj, models.ExtractionJob) and obj.batch_id:
+            state = inspect(obj)
+            if state.attrs.status.history.has_changes() or state.attrs.batch.history.has_changes():
+                batch_ids.add(obj.batch_id)
+    for obj in session.deleted:
+        if isinstance(obj, models.Invoice):
+            captured.append((obj.owner_id, "invoice_deleted", {"id": obj.id}))
+
+    if invoice_ids or batch_ids:
+        captured.extend(_batch_payloads(session.connection(), invoice_ids, batch_ids))
+    captured = [item for item in captured if item[0] is not None]
+    if not captured:
+        return
+
+    if EVENTS_BACKEND == "database":
+        # Written in the flushing transaction, so an event exists exactly when its change commits.
+        session.connection().execute(insert(models.InvoiceEvent.__table__), [
+            {"owner_id": owner_id, "event_type": event_type, "payload": json.dumps(payload)}
+            for owner_id, event_type, payload in captured
+        ])
+    session.info.setdefault("invoice_events", []).extend(captured)
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    captured = session.info.pop("invoice_events", None)
+    loop, wakeup = _loop, _wakeup
+    if not captured or loop is None:
+        return
+    if EVENTS_BACKEND == "database":
+        loop.call_soon_threadsafe(wakeup.set)
+    else:
+        loop.call_soon_threadsafe(_publish_local, captured)
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("invoice_events", None)
+
+def _publish_local(captured):
+    for owner_id, event_type, payload in captured:
+        seq = next(_seq)
+        item = Event(seq, owner_id, event_type, json.dumps(payload), f"{_EPOCH}-{seq}")
+        _recent.append(item)
+        _deliver(item)
+
+def _row_event(row) -> Event:
+    return Event(row.id, row.owner_id, row.event_type, row.payload, str(row.id))
+
+def _resume_point(last_event_id: str) -> Optional[int]:
+    """Sequence to resume after, or None when the id does not belong to this stream."""
+    if EVENTS_BACKEND == "database":
+        return int(last_event_id) if last_event_id.isdigit() else None
+    epoch, _, seq = last_event_id.rpartition("-")
+    return int(seq) if epoch == _EPOCH and seq.isdigit() else None
+
+def _replay_memory(owner_id: int, after: int):
+    # Replay only when the buffer provably holds everything after `after`.
+    if after > 0 and (not _recent or _recent[0].seq > after + 1 or _recent[-1].seq < after):
+        return None
+    return [item for item in _recent if item.owner_id == owner_id and item.seq > after]
+
+def _replay_database(owner_id: int, after: int):
+    db = database.SessionLocal()
+    try:
+        oldest = db.query(func.min(models.InvoiceEvent.id)).scalar()
+        if oldest is None or oldest > after + 1:
+            return None
+        rows = db.query(models.InvoiceEvent).filter(
+            models.InvoiceEvent.owner_id == owner_id,
+            models.InvoiceEvent.id > after
+        ).order_by(models.InvoiceEvent.id).limit(EVENTS_REPLAY_LIMIT + 1).all()
+        if len(rows) > EVENTS_REPLAY_LIMIT:
+            return None
+        return [_row_event(row) for row in rows]
+    finally:
+        db.close()
+
+async def _replay(owner_id: int, last_event_id: str):
+    """Events after last_event_id, or None when some may be gone and the client should reload."""
+    after = _resume_point(last_event_id)
+    if after is None:
+        return None
+    if EVENTS_BACKEND == "database":
+        return await run_in_threadpool(_replay_database, owner_id, after)
+    return _replay_memory(owner_id, after)
+
+def _reset_message() -> str:
+    return "event: reset\ndata: {}\n\n"
+
+async def stream(owner_id: int, last_event_id: Optional[str] = None):
+    """Server-Sent Events for one user, resuming after last_event_id when given."""
+    # Subscribe before replaying so nothing committed in between is missed; overlap is skipped by sequence.
+    subscription = subscribe(owner_id)
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        last = 0
+        if last_event_id:
+            replayed = await _replay(owner_id, last_event_id)
+            if replayed is None:
+                metrics.event_stream_resets.inc(reason="replay")
+                yield _reset_message()
+            else:
+                for item in replayed:
+                    last = item.seq
+                    yield item.message
+        deadline = time.monotonic() + EVENTS_MAX_STREAM_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                item = await asyncio.wait_for(subscription.queue.get(), min(EVENTS_HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if item is RESET:
+                yield _reset_message()
+            elif item.seq > last:
+                yield item.message
+    finally:
+        unsubscribe(subscription)
+
+def _latest_event_id() -> int:
+    db = database.SessionLocal()
+    try:
+        return db.query(func.max(models.InvoiceEvent.id)).scalar() or 0
+    finally:
+        db.close()
+
+def _fetch_events(after: int):
+    db = database.SessionLocal()
+    try:
+        return db.query(
+            models.InvoiceEvent.id,
+            models.InvoiceEvent.owner_id,
+            models.InvoiceEvent.event_type,
+            models.InvoiceEvent.payload
+        ).filter(models.InvoiceEvent.id > after).order_by(models.InvoiceEvent.id).limit(FETCH_LIMIT).all()
+    finally:
+        db.close()
+
+def prune() -> int:
+    db = database.SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=EVENTS_RETENTION_SECONDS)
+        deleted = db.query(models.InvoiceEvent).filter(
+            models.InvoiceEvent.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+async def _poll():
+    window = EVENTS_REORDER_WINDOW if database.engine.dialect.name == "postgresql" else 0
+    last_id = await run_in_threadpool(_latest_event_id)
+    delivered, delivered_ids = deque(), set()
+    next_prune = 0.0
+    while True:
+        _wakeup.clear()
+        rows = []
+        try:
+            rows = await run_in_threadpool(_fetch_events, max(last_id - window, 0))
+            for row in rows:
+                if window:
+                    if row.id in delivered_ids:
+                        continue
+                    delivered.append(row.id)
+                    delivered_ids.add(row.id)
+                last_id = max(last_id, row.id)
+                _deliver(_row_event(row))
+            while delivered and delivered[0] <= last_id - window:
+                delivered_ids.discard(delivered.popleft())
+            if time.monotonic() >= next_prune:
+                await run_in_threadpool(prune)
+                next_prune = time.monotonic() + max(EVENTS_RETENTION_SECONDS / 10, 1)
+        except Exception:
+            logger.exception("Invoice event poll failed")
+        if len(rows) >= FETCH_LIMIT:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=EVENTS_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+@metrics.collector
+def _collect_subscribers():
+    metrics.event_stream_subscribers.set(sum(len(subscriptions) for subscriptions in _subscribers.values()))
+
+async def start():
+    global _loop, _wakeup, _EPOCH, _seq
+    if _loop is not None:
+        return
+    _EPOCH = _new_epoch()
+    _seq = itertools.count(1)
+    _recent.clear()
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    if EVENTS_BACKEND == "database":
+        _tasks.append(asyncio.create_task(_poll()))
+
+async def stop():
+    global _loop, _wakeup
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    _loop = None
+    _wakeup = None
@@ -1,101 +1,221 @@
+import asyncio
 import base64
 import json
+import logging
 import os
 from typing import Optional
 
-def get_client():
-    provider = os.getenv("AI_PROVIDER", "deepseek").lower()
-    
-    if provider == "deepseek":
-        from openai import OpenAI
-        return OpenAI(
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            base_url="https://api.deepseek.com/v1"
-        ), "deepseek-chat"
-    else:
-        from openai import OpenAI
-        return OpenAI(api_key=os.getenv("OPENAI_API_KEY")), "gpt-4o"
+from pydantic import ValidationError
+
+from . import blobs, llm, metrics, parsing, providers, rules
+from .fields import AMOUNT_FIELDS, TEXT_FIELDS, parse_amount
+from ..schemas import ExtractedData
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the prompt or post-processing changes so cached results are not reused.
+PROMPT_VERSION = "2"
+
+# Rough prompt budget for packing several text invoices into one request (~4 characters per token).
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "12000"))
+LLM_BATCH_MAX_TOKENS_PER_INVOICE = int(os.getenv("LLM_BATCH_MAX_TOKENS_PER_INVOICE", "500"))
+SYSTEM_PROMPT = "You are an expert at extracting data from invoices."
+
+def cache_key(profile: Optional[dict] = None, route: Optional[providers.Route] = None):
+    """(provider, model) a result is cached under: the route that answered, else the profile's primary route.
+
+    None for endpoints a user configured themselves; the cache is shared by every user, so what such an
+    endpoint returns must never be served to anyone else.
+    """
+    route = route or providers.primary_route(profile)
+    if llm.is_custom_base_url(route.provider, route.base_url):
+        return None
+    return route.name, route.model
+
+FIELD_DESCRIPTIONS = {
+    "customer_name": "The customer's name",
+    "customer_tin": "The customer's Tax Identification Number",
+    "invoice_number": "The invoice number",
+    "invoice_date": "The invoice date",
+    "untaxed_amount": "The subtotal/untaxed amount (just the number)",
+    "total_tax": "The total tax amount (just the number)",
+    "invoice_total": "The total amount including tax (just the number)",
+    "company_name": "The company/seller name from the header",
+    "company_address": "The company address",
+    "company_tin": "The company's Tax Identification Number",
+}
+
+def build_prompt(fields=rules.FIELDS) -> str:
+    lines = "\n".join(f"- {field}: {FIELD_DESCRIPTIONS[field]}" for field in fields)
+    return f"""Extract the following fields from this invoice. Return ONLY a valid JSON object with these exact fields:
+{lines}
+
+If a field is not found, use null. Return ONLY valid JSON, no other text."""
+
+def build_batch_prompt(fields=rules.FIELDS) -> str:
+    lines = "\n".join(f"- {field}: {FIELD_DESCRIPTIONS[field]}" for field in fields)
+    return f"""Extract the following fields from each invoice below. Return ONLY a valid JSON array with one object per invoice. Each object must have an "invoice_id" field set to the id in that invoice's header line, plus these exact fields:
+{lines}
+
+If a field is not found, use null. Return ONLY valid JSON, no other text."""
+
+def _parse_json(content: str):
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.startswith("```"):
+        content = content[3:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return json.loads(content.strip())
 
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
-async def extract_invoice_data(filepath: str):
+async def _chat(messages, profile: Optional[dict] = None, max_tokens: int = 2000):
+    """(route that answered, parsed JSON content)."""
+    route, response = await providers.chat(
+        profile,
+        messages=[{"role": "system", "content": SYSTEM_PROMPT}] + messages,
+        temperature=0,
+        max_tokens=max_tokens
+    )
+    return route, _parse_json(response.choices[0].message.content or "")
+
+async def _complete(messages, profile: Optional[dict] = None):
     try:
-        with open(filepath, "rb") as f:
-            file_content = f.read()
-        
-        if filepath.lower().endswith(".pdf"):
-            import PyPDF2
-            from io import BytesIO
-            pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-            text = "\n".join([page.extract_text() for page in pdf_reader.pages])
-        else:
-            base64_image = base64.b64encode(file_content).decode("utf-8")
-            text = None
-        
-        prompt = """Extract the following fields from this invoice. Return ONLY a valid JSON object with these exact fields:
-- customer_name: The customer's name
-- customer_tin: The customer's Tax Identification Number
-- invoice_number: The invoice number
-- invoice_date: The invoice date
-- untaxed_amount: The subtotal/untaxed amount (just the number)
-- total_tax: The total tax amount (just the number)
-- invoice_total: The total amount including tax (just the number)
-- company_name: The company/seller name from the header
-- company_address: The company address
-- company_tin: The company's Tax Identification Number
+        route, data = await _chat(messages, profile)
+    except json.JSONDecodeError:
+        metrics.llm_json_failures.inc(mode="single")
+        return None, {}
+    return route, data if isinstance(data, dict) else {}
 
-If a field is not found, use null. Return ONLY valid JSON, no other text."""
+def _result(rule_fields: dict, llm_data: dict, route: Optional[providers.Route] = None) -> dict:
+    data, confidence = rules.merge(rule_fields, llm_data)
+    if not any(value is not None for value in data.values()):
+        data = {}
+    # route is None when no model answered (rules only, or unparseable output).
+    return {"data": data, "confidence": confidence, "route": route}
 
-        client, model = get_client()
+async def _text_fields(filepath: str, content_hash: Optional[str]):
+    async with blobs.local_path(filepath) as path:
+        text = await parsing.pdf_text(path, content_hash)
+    rule_fields = rules.extract(text) if rules.RULES_ENABLED else {}
+    return text, rule_fields, rules.missing(rule_fields)
 
+async def extract_invoice_data(filepath: str, content_hash: Optional[str] = None, profile: Optional[dict] = None):
+    try:
         if filepath.lower().endswith(".pdf"):
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at extracting data from invoices."},
-                    {"role": "user", "content": f"{prompt}\n\nInvoice text:\n{text[:8000]}"}
-                ],
-                temperature=0,
-                max_tokens=2000
-            )
+            text, rule_fields, missing = await _text_fields(filepath, content_hash)
+            if missing:
+                logger.info("Asking the model for %d of %d field(s) in %s", len(missing), len(rules.FIELDS), os.path.basename(filepath))
+                route, llm_data = await _complete([
+                    {"role": "user", "content": f"{build_prompt(missing)}\n\nInvoice text:\n{text}"}
+                ], profile)
+            else:
+                route, llm_data = None, {}
         else:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at extracting data from invoices."},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                    ]}
-                ],
-                temperature=0,
-                max_tokens=2000
+            async with blobs.local_path(filepath) as path:
+                image = await parsing.prepare_image(path)
+            logger.info(
+                "Image payload for %s: %d -> %d bytes across %d page(s)",
+                os.path.basename(filepath), image["original_bytes"], image["sent_bytes"], len(image["images"])
             )
-        
-        content = response.choices[0].message.content
-        content = content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
-        
-        data = json.loads(content)
-        
-        confidence = 0.85
-        
-        return {
-            "data": data,
-            "confidence": confidence
-        }
-    except json.JSONDecodeError as e:
-        return {
-            "data": {},
-            "confidence": 0.0
-        }
+            rule_fields = {}
+            route, llm_data = await _complete([
+                {"role": "user", "content": [{"type": "text", "text": build_prompt()}] + [
+                    {"type": "image_url", "image_url": {"url": f"data:{image['mime']};base64,{encoded}"}}
+                    for encoded in image["images"]
+                ]}
+            ], profile)
+
+        return _result(rule_fields, llm_data, route)
     except Exception as e:
         raise Exception(f"Extraction failed: {str(e)}")
+
+def _pack(prepared: dict):
+    """Group invoice keys so each group's text stays within the batch token budget."""
+    groups, current, size = [], [], 0
+    for key, (text, _, _) in prepared.items():
+        tokens = len(text) // 4 + 50
+        if current and size + tokens > LLM_BATCH_TOKEN_BUDGET:
+            groups.append(current)
+            current, size = [], 0
+        current.append(key)
+        size += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def _normalize(element: dict) -> dict:
+    # Models write ids as bare numbers and amounts as "1,234.50"; neither should cost the invoice its batch slot.
+    element = dict(element)
+    for field in (*TEXT_FIELDS, "invoice_date"):
+        value = element.get(field)
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            element[field] = str(value)
+    for field in AMOUNT_FIELDS:
+        if field in element:
+            element[field] = parse_amount(element[field])
+    return element
+
+def _validate_batch(content, keys) -> dict:
+    wanted = {str(key): key for key in keys}
+    validated = {}
+    for element in content if isinstance(content, list) else []:
+        if not isinstance(element, dict):
+            continue
+        key = wanted.get(str(element.get("invoice_id")))
+        if key is None or key in validated:
+            continue
+        try:
+            validated[key] = ExtractedData.model_validate(_normalize(element)).model_dump()
+        except ValidationError:
+            continue
+    return validated
+
+async def _extract_group(prepared: dict, keys, profile: Optional[dict] = None) -> dict:
+    fields = [field for field in rules.FIELDS if any(field in prepared[key][2] for key in keys)]
+    invoices = "\n\n".join(f"=== Invoice {key} ===\n{prepared[key][0]}" for key in keys)
+    try:
+        route, content = await _chat(
+            [{"role": "user", "content": f"{build_batch_prompt(fields)}\n\n{invoices}"}],
+            profile,
+            max_tokens=max(2000, LLM_BATCH_MAX_TOKENS_PER_INVOICE * len(keys))
+        )
+    except json.JSONDecodeError:
+        metrics.llm_json_failures.inc(mode="batch")
+        return {}
+    except Exception as e:
+        logger.warning("Batched extraction of %d invoices failed: %s", len(keys), e)
+        return {}
+    validated = _validate_batch(content, keys)
+    if len(validated) < len(keys):
+        logger.info("Batched extraction returned %d of %d invoices", len(validated), len(keys))
+    return {key: _result(prepared[key][1], data, route) for key, data in validated.items()}
+
+async def extract_invoice_batch(items: dict, profile: Optional[dict] = None) -> dict:
+    """Extract several text PDFs ({key: (filepath, content_hash)}) with as few model calls as possible.
+
+    Keys missing from the returned dict could not be extracted in a batch and need a single call.
+    """
+    results = {}
+    prepared = {}
+    for key, (filepath, content_hash) in items.items():
+        try:
+            text, rule_fields, missing = await _text_fields(filepath, content_hash)
+        except Exception as e:
+            logger.warning("Could not read %s for batching: %s", os.path.basename(filepath), e)
+            continue
+        if missing:
+            prepared[key] = (text, rule_fields, missing)
+        else:
+            results[key] = _result(rule_fields, {})
+
+    groups = [keys for keys in _pack(prepared) if len(keys) > 1]
+    for extracted in await asyncio.gather(*(_extract_group(prepared, keys, profile) for keys in groups)):
+        results.update(extracted)
+    return results
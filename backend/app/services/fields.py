@@ -0,0 +1,52 @@
+import re
+from datetime import date, datetime
+from typing import Optional
+
+TEXT_FIELDS = ("customer_name", "customer_tin", "invoice_number", "company_name", "company_address", "company_tin")
+AMOUNT_FIELDS = ("untaxed_amount", "total_tax", "invoice_total")
+
+DATE_FORMATS = (
+    "%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%m/%d/%Y",
+    "%d/%m/%y", "%d-%m-%y", "%d %B %Y", "%d %b %Y", "%B %d, %Y", "%b %d, %Y", "%d-%b-%Y", "%d-%b-%y",
+)
+
+def parse_date(value) -> Optional[date]:
+    if value is None:
+        return None
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_amount(value) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[^\d.\-]", "", str(value).replace(",", ""))
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+def to_columns(data: Optional[dict]) -> dict:
+    data = data or {}
+    columns = {}
+    for field in TEXT_FIELDS:
+        value = data.get(field)
+        columns[field] = str(value).strip() if value not in (None, "") else None
+    for field in AMOUNT_FIELDS:
+        columns[field] = parse_amount(data.get(field))
+    columns["invoice_date"] = parse_date(data.get("invoice_date"))
+    return columns
@@ -0,0 +1,119 @@
+"""Cache validators for invoice reads: ETag/Last-Modified headers and 304 answers to conditional GETs.
+
+A single invoice is validated by its updated_at. Lists and stats are validated by the owner's change
+version, a counter bumped in the same flush as any change to their invoices. A repeat view therefore
+costs one primary-key lookup instead of the query behind it.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .. import models
+from .compression import ETAG_SUFFIXES
+
+# Part of every tag: bump it when a response's shape changes, so clients do not keep the old one.
+REPRESENTATION_VERSION = 1
+
+CACHE_CONTROL = "private, no-cache"  # cache, but revalidate before every reuse
+
+def _touched_owners(session):
+    owners = set()
+    for obj in session.new | session.deleted:
+        if isinstance(obj, models.Invoice):
+            owners.add(obj.owner_id)
+    for obj in session.dirty:
+        if isinstance(obj, models.Invoice) and session.is_modified(obj):
+            owners.add(obj.owner_id)
+    owners.discard(None)
+    return owners
+
+def _bump(session, owner_id: int, now: datetime):
+    table = models.InvoiceChangeVersion.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        stmt = insert(table).values(owner_id=owner_id, version=1, updated_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["owner_id"],
+            set_={"version": table.c.version + 1, "updated_at": now}
+        )
+        session.execute(stmt)
+        return
+
+    updated = session.execute(
+        table.update().where(table.c.owner_id == owner_id).values(version=table.c.version + 1, updated_at=now)
+    ).rowcount
+    if not updated:
+        session.execute(table.insert().values(owner_id=owner_id, version=1, updated_at=now))
+
+@event.listens_for(Session, "before_flush")
+def _bump_versions(session, flush_context, instances):
+    now = datetime.utcnow()
+    for owner_id in sorted(_touched_owners(session)):
+        _bump(session, owner_id, now)
+
+def owner_version(db, owner_id: int):
+    """(version, last change) of the owner's invoices; (0, None) until the first change."""
+    row = db.query(models.InvoiceChangeVersion.version, models.InvoiceChangeVersion.updated_at).filter(
+        models.InvoiceChangeVersion.owner_id == owner_id
+    ).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+def make_etag(*parts) -> str:
+    key = "|".join(str(part) for part in (REPRESENTATION_VERSION, *parts))
+    return f'"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Authorization"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+def _opaque(tag: str) -> str:
+    # If-None-Match compares weakly, and a compressed copy carries our tag with an encoding suffix.
+    tag = tag.strip().removeprefix("W/")
+    for suffix in ETAG_SUFFIXES:
+        if tag.endswith(f'{suffix}"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+def _modified_since(header: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have whole seconds.
+    return last_modified.replace(microsecond=0, tzinfo=timezone.utc) > since
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> Optional[Response]:
+    """A 304 response when the client's copy is still current, otherwise None."""
+    headers = validator_headers(etag, last_modified)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present.
+        for tag in (tag.strip() for tag in if_none_match.split(",")):
+            if tag == "*":
+                return Response(status_code=304, headers=headers)
+            if _opaque(tag) == etag:
+                # Echo the tag as the client holds it, encoding suffix included.
+                headers["ETag"] = tag
+                return Response(status_code=304, headers=headers)
+        return None
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None and not _modified_since(if_modified_since, last_modified):
+        return Response(status_code=304, headers=headers)
+    return None
@@ -0,0 +1,542 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+
+from .. import models, database
+from . import blobs, cache, events, metrics, parsing, providers, stats  # noqa: F401 - stats and events hook into session flushes
+from .fields import to_columns
+from .extractor import cache_key, extract_invoice_batch, extract_invoice_data, PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+# Under gunicorn (see gunicorn.conf.py) only the worker holding this file lock runs the queue, so JOB_WORKERS
+# and the parser pool exist once per server rather than once per worker. Unset, every process runs its own.
+JOB_QUEUE_LOCK = os.getenv("JOB_QUEUE_LOCK") or None
+JOB_QUEUE_LOCK_POLL_SECONDS = float(os.getenv("JOB_QUEUE_LOCK_POLL_SECONDS", "5"))
+# Text PDFs of one owner claimed together and sent to the model in one request; 1 disables batching.
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "1"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+_tasks: list = []
+_in_flight: set = set()
+_queue_lock = None
+
+def enqueue(db, invoice: models.Invoice, bypass_cache: bool = False, max_attempts: int = JOB_MAX_ATTEMPTS):
+    return enqueue_many(db, [invoice], bypass_cache=bypass_cache, max_attempts=max_attempts)[0]
+
+def enqueue_many(db, invoices, batch: Optional[models.ExtractionBatch] = None,
+                 bypass_cache: bool = False, max_attempts: int = JOB_MAX_ATTEMPTS):
+    active = {}
+    if invoices:
+        active = {job.invoice_id: job for job in db.query(models.ExtractionJob).filter(
+            models.ExtractionJob.invoice_id.in_([invoice.id for invoice in invoices]),
+            models.ExtractionJob.status.in_(ACTIVE_STATUSES)
+        )}
+
+    queued = []
+    for invoice in invoices:
+        job = active.get(invoice.id)
+        if job is None:
+            job = models.ExtractionJob(
+                invoice_id=invoice.id,
+                owner_id=invoice.owner_id,
+                status="queued",
+                max_attempts=max_attempts,
+                bypass_cache=bypass_cache,
+                run_after=datetime.utcnow()
+            )
+            invoice.status = "pending"
+            invoice.error_message = None
+            db.add(job)
+        elif bypass_cache:
+            job.bypass_cache = True
+        if batch is not None:
+            job.batch = batch
+        queued.append(job)
+
+    db.commit()
+    notify()
+    return queued
+
+def create_batch(db, owner_id: int, invoices, bypass_cache: bool = False):
+    batch = models.ExtractionBatch(owner_id=owner_id)
+    db.add(batch)
+    enqueue_many(db, invoices, batch=batch, bypass_cache=bypass_cache)
+    db.refresh(batch)
+    return batch
+
+def batch_progress(db, batch: models.ExtractionBatch) -> dict:
+    rows = db.query(
+        models.ExtractionJob.id,
+        models.ExtractionJob.invoice_id,
+        models.ExtractionJob.attempts,
+        models.Invoice.filename,
+        models.Invoice.status,
+        models.Invoice.error_message
+    ).join(models.Invoice, models.Invoice.id == models.ExtractionJob.invoice_id).filter(
+        models.ExtractionJob.batch_id == batch.id
+    ).order_by(models.ExtractionJob.id).all()
+
+    counts = {"pending": 0, "processing": 0, "completed": 0, "failed": 0}
+    items = []
+    for job_id, invoice_id, attempts, filename, status, error_message in rows:
+        counts[status] = counts.get(status, 0) + 1
+        items.append({
+            "job_id": job_id,
+            "invoice_id": invoice_id,
+            "filename": filename,
+            "status": status,
+            "attempts": attempts or 0,
+            "error_message": error_message
+        })
+    return {
+        "id": batch.id,
+        "total": len(items),
+        **counts,
+        "finished": counts["completed"] + counts["failed"] == len(items),
+        "created_at": batch.created_at,
+        "items": items
+    }
+
+def notify():
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+def retry_delay(attempts: int) -> float:
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.5, 1.0)
+
+def _claim_next() -> Optional[int]:
+    db = database.SessionLocal()
+    try:
+        now = datetime.utcnow()
+        busy_owners = db.query(models.ExtractionJob.owner_id).filter(
+            models.ExtractionJob.status == "running"
+        ).group_by(models.ExtractionJob.owner_id).having(
+            func.count(models.ExtractionJob.id) >= JOB_MAX_PER_USER
+        )
+        candidates = db.query(models.ExtractionJob.id, models.ExtractionJob.owner_id).filter(
+            models.ExtractionJob.status == "queued",
+            models.ExtractionJob.run_after <= now,
+            ~models.ExtractionJob.owner_id.in_(busy_owners.scalar_subquery())
+        ).order_by(models.ExtractionJob.run_after, models.ExtractionJob.id).limit(5).all()
+
+        running = aliased(models.ExtractionJob)
+        for job_id, owner_id in candidates:
+            # The filter above is only a hint: other workers may claim for this owner in the meantime. Locking
+            # the owner's row serializes their claims on Postgres (SQLite admits one writer anyway), and the
+            # limit is checked again inside the claiming UPDATE. NO KEY leaves foreign-key checks unblocked.
+            db.query(models.User.id).filter(models.User.id == owner_id).with_for_update(key_share=True).first()
+            running_count = db.query(func.count(running.id)).filter(
+                running.owner_id == owner_id,
+                running.status == "running"
+            ).scalar_subquery()
+            claimed = db.query(models.ExtractionJob).filter(
+                models.ExtractionJob.id == job_id,
+                models.ExtractionJob.status == "queued",
+                running_count < JOB_MAX_PER_USER
+            ).update({
+                models.ExtractionJob.status: "running",
+                models.ExtractionJob.locked_at: now,
+                models.ExtractionJob.attempts: models.ExtractionJob.attempts + 1,
+                models.ExtractionJob.updated_at: now
+            }, synchronize_session=False)
+            if claimed:
+                job = db.get(models.ExtractionJob, job_id)
+                if job.invoice:
+                    job.invoice.status = "processing"
+                db.commit()
+                return job_id
+            db.rollback()
+        return None
+    finally:
+        db.close()
+
+def _claim_companions(job_id: int, limit: int):
+    """Claim more ready text-PDF jobs of the same owner to share the model request with job_id."""
+    db = database.SessionLocal()
+    try:
+        job = db.get(models.ExtractionJob, job_id)
+        if job is None or job.invoice is None or not job.invoice.filepath.lower().endswith(".pdf"):
+            return []
+        now = datetime.utcnow()
+        candidates = db.query(models.ExtractionJob.id).join(
+            models.Invoice, models.Invoice.id == models.ExtractionJob.invoice_id
+        ).filter(
+            models.ExtractionJob.owner_id == job.owner_id,
+            models.ExtractionJob.status == "queued",
+            models.ExtractionJob.run_after <= now,
+            func.lower(models.Invoice.filepath).like("%.pdf")
+        ).order_by(models.ExtractionJob.run_after, models.ExtractionJob.id).limit(limit).all()
+
+        claimed_ids = []
+        for (candidate_id,) in candidates:
+            # Companions ride on the claimed job's request, so they do not count against JOB_MAX_PER_USER.
+            claimed = db.query(models.ExtractionJob).filter(
+                models.ExtractionJob.id == candidate_id,
+                models.ExtractionJob.status == "queued"
+            ).update({
+                models.ExtractionJob.status: "running",
+                models.ExtractionJob.locked_at: now,
+                models.ExtractionJob.attempts: models.ExtractionJob.attempts + 1,
+                models.ExtractionJob.updated_at: now
+            }, synchronize_session=False)
+            if claimed:
+                claimed_ids.append(candidate_id)
+        for companion in db.query(models.ExtractionJob).filter(models.ExtractionJob.id.in_(claimed_ids)):
+            if companion.invoice:
+                companion.invoice.status = "processing"
+        db.commit()
+        return claimed_ids
+    finally:
+        db.close()
+
+def _load(job_id: int):
+    db = database.SessionLocal()
+    try:
+        job = db.get(models.ExtractionJob, job_id)
+        if job is None or job.invoice is None:
+            return None
+        profile = providers.load_profile(db, job.owner_id)
+        return job.invoice.filepath, job.invoice.content_hash, job.bypass_cache, profile
+    finally:
+        db.close()
+
+def _cached_result(content_hash: str, profile: dict):
+    key = cache_key(profile)
+    if key is None:
+        return None
+    db = database.SessionLocal()
+    try:
+        return cache.lookup(db, content_hash, *key, PROMPT_VERSION)
+    finally:
+        db.close()
+
+def _complete(job_id: int, result: dict, content_hash: Optional[str] = None, profile: Optional[dict] = None):
+    db = database.SessionLocal()
+    try:
+        key = cache_key(profile, result.get("route")) if content_hash and result["data"] else None
+        if key is not None:
+            # Filed under the route that actually answered, which may be a fallback provider.
+            cache.store(db, content_hash, *key, PROMPT_VERSION, result)
+        job = db.get(models.ExtractionJob, job_id)
+        if job is None:
+            return
+        invoice = job.invoice
+        if invoice is not None:
+            invoice.extracted_data = json.dumps(result["data"])
+            for column, value in to_columns(result["data"]).items():
+                setattr(invoice, column, value)
+            invoice.status = "completed"
+            invoice.confidence = result["confidence"]
+            invoice.error_message = None
+            invoice.updated_at = datetime.utcnow()
+        job.status = "done"
+        job.last_error = None
+        job.locked_at = None
+        db.commit()
+    finally:
+        db.close()
+
+def _fail(job_id: int, error: str):
+    db = database.SessionLocal()
+    try:
+        job = db.get(models.ExtractionJob, job_id)
+        if job is None or job.status != "running":
+            return
+        invoice = job.invoice
+        job.last_error = error
+        job.locked_at = None
+        if invoice is not None and job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts))
+            invoice.status = "pending"
+        else:
+            job.status = "failed"
+            if invoice is not None:
+                invoice.status = "failed"
+        if invoice is not None:
+            invoice.error_message = error
+        db.commit()
+    finally:
+        db.close()
+
+def _renew(job_ids):
+    db = database.SessionLocal()
+    try:
+        db.query(models.ExtractionJob).filter(
+            models.ExtractionJob.id.in_(job_ids),
+            models.ExtractionJob.status == "running"
+        ).update({models.ExtractionJob.locked_at: datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def _requeue(job_ids):
+    db = database.SessionLocal()
+    try:
+        for job in db.query(models.ExtractionJob).filter(
+            models.ExtractionJob.id.in_(job_ids),
+            models.ExtractionJob.status == "running"
+        ):
+            job.status = "queued"
+            job.locked_at = None
+            job.attempts = max(job.attempts - 1, 0)
+            if job.invoice is not None:
+                job.invoice.status = "pending"
+        db.commit()
+    finally:
+        db.close()
+
+def recover_stale_jobs() -> int:
+    db = database.SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS)
+        stale = db.query(models.ExtractionJob).filter(
+            models.ExtractionJob.status == "running",
+            models.ExtractionJob.locked_at < cutoff
+        ).all()
+        for job in stale:
+            job.status = "queued"
+            job.locked_at = None
+            job.run_after = datetime.utcnow()
+            if job.invoice is not None:
+                job.invoice.status = "pending"
+        db.commit()
+        return len(stale)
+    finally:
+        db.close()
+
+def _evict_cache():
+    db = database.SessionLocal()
+    try:
+        return cache.evict(db)
+    finally:
+        db.close()
+
+async def _prepare(job_id: int):
+    """Load a claimed job, finishing it right away when it cannot run or the cache already has the answer."""
+    loaded = await run_in_threadpool(_load, job_id)
+    if loaded is None:
+        await run_in_threadpool(_fail, job_id, "Invoice not found")
+        return None
+    filepath, content_hash, bypass_cache, profile = loaded
+
+    if content_hash and not bypass_cache:
+        cached = await run_in_threadpool(_cached_result, content_hash, profile)
+        if cached is not None:
+            await run_in_threadpool(_complete, job_id, cached)
+            metrics.extraction_jobs.inc(outcome="cached")
+            return None
+    return filepath, content_hash, profile
+
+async def _extract_one(job_id: int, filepath: str, content_hash: Optional[str], profile: dict):
+    start = time.perf_counter()
+    try:
+        with metrics.span("extraction.job", job_id=job_id):
+            result = await extract_invoice_data(filepath, content_hash, profile)
+    except Exception as e:
+        logger.warning("Extraction job %s failed: %s", job_id, e)
+        metrics.extraction_duration.observe(time.perf_counter() - start, outcome="error")
+        metrics.extraction_jobs.inc(outcome="error")
+        await run_in_threadpool(_fail, job_id, str(e))
+    else:
+        metrics.extraction_duration.observe(time.perf_counter() - start, outcome="completed")
+        metrics.extraction_jobs.inc(outcome="completed")
+        await run_in_threadpool(_complete, job_id, result, content_hash, profile)
+
+async def run_job(job_id: int):
+    prepared = await _prepare(job_id)
+    if prepared is not None:
+        await _extract_one(job_id, *prepared)
+
+async def run_jobs(job_ids):
+    """Run several claimed text-PDF jobs, sharing model requests and falling back to single calls."""
+    pending = {}
+    for job_id in job_ids:
+        try:
+            prepared = await _prepare(job_id)
+        except Exception as e:
+            logger.warning("Extraction job %s failed: %s", job_id, e)
+            await run_in_threadpool(_fail, job_id, str(e))
+            continue
+        if prepared is not None:
+            pending[job_id] = prepared
+
+    results = {}
+    if len(pending) > 1:
+        # Companions are claimed for the same owner, so they share one provider profile.
+        profile = next(iter(pending.values()))[2]
+        items = {job_id: (filepath, content_hash) for job_id, (filepath, content_hash, _) in pending.items()}
+        start = time.perf_counter()
+        try:
+            with metrics.span("extraction.batch", size=len(items)):
+                results = await extract_invoice_batch(items, profile)
+        except Exception as e:
+            logger.warning("Batched extraction of jobs %s failed, extracting them one by one: %s", list(items), e)
+        elapsed = time.perf_counter() - start
+    for job_id, (filepath, content_hash, profile) in pending.items():
+        if job_id in results:
+            metrics.extraction_duration.observe(elapsed, outcome="batched")
+            metrics.extraction_jobs.inc(outcome="batched")
+            await run_in_threadpool(_complete, job_id, results[job_id], content_hash, profile)
+        else:
+            await _extract_one(job_id, filepath, content_hash, profile)
+
+@metrics.collector
+def _collect_queue():
+    db = database.SessionLocal()
+    try:
+        rows = db.query(models.ExtractionJob.status, func.count(models.ExtractionJob.id)).filter(
+            models.ExtractionJob.status.in_(ACTIVE_STATUSES)
+        ).group_by(models.ExtractionJob.status).all()
+        cache_entries = db.query(func.count(models.ExtractionCache.id)).scalar()
+    finally:
+        db.close()
+    counts = dict.fromkeys(ACTIVE_STATUSES, 0)
+    counts.update(rows)
+    metrics.extraction_queue_depth.replace({(status,): count for status, count in counts.items()})
+    metrics.extraction_in_flight.set(len(_in_flight))
+    metrics.extraction_cache_events.replace({(event,): count for event, count in cache.counters.items()})
+    metrics.extraction_cache_entries.set(cache_entries)
+
+async def _keep_leased(job_ids):
+    # A batch and its one-by-one fallback can outlast the lease; renew it so the jobs are not handed out again.
+    while True:
+        await asyncio.sleep(max(JOB_LEASE_SECONDS / 3, 1))
+        try:
+            await run_in_threadpool(_renew, list(job_ids))
+        except Exception:
+            logger.exception("Failed to renew the lease of extraction jobs %s", job_ids)
+
+async def _abandon(job_ids, error: str):
+    # Jobs a crash left running are retried (or failed) now instead of when their lease runs out.
+    for job_id in job_ids:
+        try:
+            await run_in_threadpool(_fail, job_id, error)
+        except Exception:
+            logger.exception("Failed to release extraction job %s", job_id)
+
+async def _worker():
+    while True:
+        _wakeup.clear()
+        try:
+            job_id = await run_in_threadpool(_claim_next)
+        except Exception:
+            logger.exception("Failed to claim extraction job")
+            job_id = None
+        if job_id is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        job_ids = [job_id]
+        _in_flight.add(job_id)
+        lease = asyncio.create_task(_keep_leased(job_ids))
+        try:
+            if LLM_BATCH_SIZE > 1:
+                job_ids += await run_in_threadpool(_claim_companions, job_id, LLM_BATCH_SIZE - 1)
+                _in_flight.update(job_ids)
+            if len(job_ids) > 1:
+                await run_jobs(job_ids)
+            else:
+                await run_job(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Extraction jobs %s crashed", job_ids)
+            await _abandon(job_ids, f"Extraction crashed: {e}")
+        finally:
+            lease.cancel()
+        _in_flight.difference_update(job_ids)
+
+async def _maintenance():
+    while True:
+        try:
+            recovered = await run_in_threadpool(recover_stale_jobs)
+            if recovered:
+                logger.info("Requeued %s stale extraction jobs", recovered)
+                _wakeup.set()
+            await run_in_threadpool(_evict_cache)
+            reclaimed = await run_in_threadpool(blobs.collect_garbage)
+            if reclaimed:
+                logger.info("Reclaimed %s unreferenced upload blobs", reclaimed)
+        except Exception:
+            logger.exception("Extraction queue maintenance failed")
+        await asyncio.sleep(max(JOB_LEASE_SECONDS / 2, 1))
+
+def _acquire_queue_lock() -> bool:
+    global _queue_lock
+    import fcntl
+
+    f = open(JOB_QUEUE_LOCK, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return False
+    # Held until this process exits; a worker still waiting then takes over.
+    _queue_lock = f
+    return True
+
+async def _run_queue(workers: int, warm_parsers: bool):
+    if JOB_QUEUE_LOCK:
+        while not await run_in_threadpool(_acquire_queue_lock):
+            await asyncio.sleep(JOB_QUEUE_LOCK_POLL_SECONDS)
+        logger.info("Worker %s runs the extraction queue", os.getpid())
+    if warm_parsers:
+        try:
+            await parsing.warm_pool()
+        except Exception:
+            logger.warning("Warming the parser pool failed", exc_info=True)
+    _tasks.append(asyncio.create_task(_maintenance()))
+    for _ in range(workers):
+        _tasks.append(asyncio.create_task(_worker()))
+
+async def start(workers: Optional[int] = None, warm_parsers: bool = False):
+    global _loop, _wakeup
+    workers = JOB_WORKERS if workers is None else workers
+    if _tasks or workers <= 0:
+        return
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    if JOB_QUEUE_LOCK:
+        _tasks.append(asyncio.create_task(_run_queue(workers, warm_parsers)))
+    else:
+        await _run_queue(workers, warm_parsers)
+
+async def stop():
+    global _loop, _wakeup, _queue_lock
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    if _in_flight:
+        await run_in_threadpool(_requeue, list(_in_flight))
+        _in_flight.clear()
+    if _queue_lock is not None:
+        _queue_lock.close()
+        _queue_lock = None
+    _loop = None
+    _wakeup = None
@@ -0,0 +1,79 @@
+import os
+from typing import Optional
+
+import httpx
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+# Retries, fallback and hedging happen in services.providers; the SDK's own retries would hide failures from it.
+LLM_CLIENT_MAX_RETRIES = int(os.getenv("LLM_CLIENT_MAX_RETRIES", "0"))
+
+PROVIDERS = {
+    "deepseek": {"base_url": "https://api.deepseek.com/v1", "model": "deepseek-chat", "api_key_env": "DEEPSEEK_API_KEY"},
+    "openai": {"base_url": None, "model": "gpt-4o", "api_key_env": "OPENAI_API_KEY"},
+}
+
+_clients = {}
+
+def _http2_available():
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def default_provider():
+    provider = os.getenv("AI_PROVIDER", "deepseek").lower()
+    return provider if provider in PROVIDERS else "openai"
+
+def default_model(provider: str):
+    return PROVIDERS.get(provider, PROVIDERS["openai"])["model"]
+
+def is_custom_base_url(provider: str, base_url: Optional[str]) -> bool:
+    return bool(base_url) and base_url != PROVIDERS.get(provider, PROVIDERS["openai"])["base_url"]
+
+def get_client(provider: Optional[str] = None, api_key: Optional[str] = None, base_url: Optional[str] = None):
+    provider = (provider or default_provider()).lower()
+    config = PROVIDERS.get(provider, PROVIDERS["openai"])
+    if is_custom_base_url(provider, base_url):
+        if not api_key:
+            # AsyncOpenAI would otherwise pick up OPENAI_API_KEY from the environment and send it there.
+            raise ValueError("A custom base_url needs its own API key")
+    else:
+        base_url = config["base_url"]
+        api_key = api_key or os.getenv(config["api_key_env"])
+
+    key = (provider, base_url, api_key)
+    client = _clients.get(key)
+    if client is None:
+        from openai import AsyncOpenAI
+        http_client = httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        )
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=LLM_CLIENT_MAX_RETRIES)
+        _clients[key] = client
+    return client
+
+def warm_default_client():
+    """Build the default provider's client up front (openai import, TLS context) when its key is set."""
+    provider = default_provider()
+    if os.getenv(PROVIDERS[provider]["api_key_env"]):
+        get_client(provider)
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
@@ -0,0 +1,231 @@
+import contextlib
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 5 * 1024 ** 2, 20 * 1024 ** 2, 50 * 1024 ** 2)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+_registry = []
+_collectors = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def replace(self, values: dict):
+        """Swap in a fresh set of {label tuple: value}, for series computed at scrape time."""
+        with self._lock:
+            self._values = dict(values)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency by route template (not raw path, to bound label cardinality)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        streaming = False
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = (b"content-type", b"text/event-stream") in message.get("headers", ())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if streaming:
+                # Event streams stay open for the whole session; their duration is not request latency.
+                return
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status
+            )
+
+def collector(fn):
+    """Register a function that refreshes gauges right before each scrape."""
+    _collectors.append(fn)
+    return fn
+
+def render() -> str:
+    for fn in _collectors:
+        fn()
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+_tracer = None
+
+def _get_tracer():
+    global _tracer
+    if _tracer is None:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            _tracer = False
+        else:
+            _tracer = trace.get_tracer("invoice-extraction")
+    return _tracer
+
+def span(name: str, **attributes):
+    """OpenTelemetry span when TRACING_ENABLED and the SDK is installed, otherwise a no-op."""
+    if not TRACING_ENABLED:
+        return contextlib.nullcontext()
+    tracer = _get_tracer()
+    if not tracer:
+        return contextlib.nullcontext()
+    return tracer.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None})
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status")
+)
+upload_write_duration = Histogram("upload_write_duration_seconds", "Time to stream one upload to disk.")
+upload_bytes = Histogram("upload_bytes", "Size of accepted uploads.", buckets=SIZE_BUCKETS)
+blob_store_events = Counter("blob_store_events_total", "Upload blobs stored, deduplicated and reclaimed.", ("event",))
+uploads_rejected = Counter("uploads_rejected_total", "Uploads rejected during validation.", ("reason",))
+pdf_parse_duration = Histogram("pdf_parse_duration_seconds", "PDF text extraction time.", ("cached",))
+image_prepare_duration = Histogram("image_prepare_duration_seconds", "Image preprocessing time.")
+image_bytes = Histogram("image_bytes", "Image payload size before and after preprocessing.", ("stage",), buckets=SIZE_BUCKETS)
+llm_request_duration = Histogram(
+    "llm_request_duration_seconds", "LLM chat completion latency.", ("provider", "model", "outcome")
+)
+llm_tokens = Counter("llm_tokens_total", "Tokens reported by the LLM provider.", ("provider", "model", "type"))
+llm_request_tokens = Histogram("llm_request_tokens", "Total tokens per LLM request.", ("provider",), buckets=TOKEN_BUCKETS)
+llm_json_failures = Counter("llm_json_parse_failures_total", "LLM replies that were not valid JSON.", ("mode",))
+llm_circuit_open = Gauge("llm_circuit_open", "1 while the circuit for a provider endpoint is open.", ("endpoint",))
+db_commit_duration = Histogram("db_commit_duration_seconds", "Session commit time, including the final flush.")
+extraction_duration = Histogram("extraction_duration_seconds", "End-to-end extraction time per job.", ("outcome",))
+extraction_jobs = Counter("extraction_jobs_total", "Finished extraction job attempts.", ("outcome",))
+extraction_queue_depth = Gauge("extraction_queue_depth", "Extraction jobs by status.", ("status",))
+extraction_in_flight = Gauge("extraction_in_flight", "Extraction jobs running in this process.")
+event_stream_subscribers = Gauge("event_stream_subscribers", "Open invoice event streams in this process.")
+event_stream_resets = Counter("event_stream_resets_total", "Event streams told to reload instead of resuming.", ("reason",))
+extraction_cache_events = Counter("extraction_cache_events_total", "Extraction cache lookups, writes and evictions.", ("event",))
+extraction_cache_entries = Gauge("extraction_cache_entries", "Rows in the extraction cache, across all users.")
+
+@event.listens_for(Session, "before_commit")
+def _commit_started(session):
+    if METRICS_ENABLED:
+        session.info["commit_started"] = time.perf_counter()
+
+@event.listens_for(Session, "after_commit")
+def _commit_finished(session):
+    start = session.info.pop("commit_started", None)
+    if start is not None:
+        db_commit_duration.observe(time.perf_counter() - start)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _commit_abandoned(session, previous_transaction):
+    session.info.pop("commit_started", None)
@@ -0,0 +1,186 @@
+import asyncio
+import base64
+import contextlib
+import glob
+import mmap
+import multiprocessing
+import os
+import time
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from . import metrics
+
+PDF_TEXT_BUDGET = int(os.getenv("PDF_TEXT_BUDGET", "8000"))
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR", "uploads/.text")
+
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2000"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "true").lower() == "true"
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()  # JPEG, PNG or WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_MAX_PAGES = int(os.getenv("IMAGE_MAX_PAGES", "5"))
+
+IMAGE_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the API process runs an event loop and thread pools that must not be forked.
+        _pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=_load_parsers
+        )
+    return _pool
+
+def _load_parsers():
+    import PyPDF2  # noqa: F401
+    from PIL import Image  # noqa: F401
+
+def _ready():
+    return os.getpid()
+
+async def warm_pool():
+    """Start every parser process ahead of the first upload, each with PyPDF2 and Pillow loaded."""
+    await asyncio.gather(*(run_in_pool(_ready) for _ in range(PARSE_WORKERS)))
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def run_in_pool(fn, *args):
+    global _pool
+    pool = get_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # A worker crashed (e.g. a malformed file blew up the parser); replace the pool for later calls.
+        if _pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        raise
+
+@contextlib.contextmanager
+def mapped(path: str):
+    """Read-only memory map of a file: parsers page in what they touch instead of copying it whole."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield data
+
+def extract_pdf_text(path: str, budget: int) -> str:
+    import PyPDF2
+
+    parts = []
+    size = 0
+    # PdfReader given a path reads the whole file into a BytesIO first; a map avoids that copy.
+    with mapped(path) as data:
+        reader = PyPDF2.PdfReader(data)
+        for page in reader.pages:
+            text = page.extract_text() or ""
+            parts.append(text)
+            size += len(text) + 1
+            if size >= budget:
+                break
+    return "\n".join(parts)[:budget]
+
+def _cache_path(content_hash: str, budget: int) -> str:
+    return os.path.join(TEXT_CACHE_DIR, f"{content_hash}.{budget}.txt")
+
+def forget_text(content_hash: str):
+    """Remove the cached text of an upload, for every budget (and any partial write left behind)."""
+    for entry in glob.glob(os.path.join(TEXT_CACHE_DIR, f"{glob.escape(content_hash)}.*")):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(entry)
+
+def _read_cached(path: str) -> Optional[str]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_cached(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.part"
+    with open(partial, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(partial, path)
+
+async def pdf_text(path: str, content_hash: Optional[str] = None, budget: int = PDF_TEXT_BUDGET) -> str:
+    start = time.perf_counter()
+    cache_path = _cache_path(content_hash, budget) if content_hash else None
+    if cache_path:
+        cached = await asyncio.to_thread(_read_cached, cache_path)
+        if cached is not None:
+            metrics.pdf_parse_duration.observe(time.perf_counter() - start, cached="true")
+            return cached
+
+    with metrics.span("pdf.parse", budget=budget):
+        text = await run_in_pool(extract_pdf_text, path, budget)
+    if cache_path:
+        await asyncio.to_thread(_write_cached, cache_path, text)
+    metrics.pdf_parse_duration.observe(time.perf_counter() - start, cached="false")
+    return text
+
+def _has_alpha(image) -> bool:
+    return image.mode in ("RGBA", "LA", "PA", "RGBa", "La") or "transparency" in image.info
+
+def _on_white(image):
+    # Transparent pixels usually hold black; dropping the alpha channel would turn the page black.
+    from PIL import Image
+
+    image = image.convert("RGBA")
+    background = Image.new("RGB", image.size, "white")
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+def preprocess_image(path: str, max_dimension: int, grayscale: bool, fmt: str, quality: int, max_pages: int) -> dict:
+    from PIL import Image, ImageOps, ImageSequence
+
+    mode = "L" if grayscale else "RGB"
+    pages = []
+    transparent = False
+    with mapped(path) as data, Image.open(data) as img:
+        original_bytes = len(data)
+        source_format = img.format
+        if source_format == "JPEG":
+            # Let the decoder downscale by a power of two while reading large JPEGs.
+            img.draft(mode, (max_dimension, max_dimension))
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            if index >= max_pages:
+                break
+            page = ImageOps.exif_transpose(frame.copy())
+            if _has_alpha(page):
+                transparent = True
+                page = _on_white(page)
+            page = page.convert(mode)
+            page.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            buffer = BytesIO()
+            page.save(buffer, fmt, quality=quality, optimize=True)
+            pages.append(buffer.getvalue())
+
+        mime = IMAGE_MIME_TYPES[fmt]
+        if len(pages) == 1 and len(pages[0]) >= original_bytes and source_format in IMAGE_MIME_TYPES and not transparent:
+            # Already small and in a format the vision API accepts; re-encoding would only grow it.
+            pages = [data[:]]
+            mime = IMAGE_MIME_TYPES[source_format]
+
+    return {
+        "mime": mime,
+        "images": [base64.b64encode(page).decode("ascii") for page in pages],
+        "original_bytes": original_bytes,
+        "sent_bytes": sum(len(page) for page in pages),
+    }
+
+async def prepare_image(path: str) -> dict:
+    with metrics.image_prepare_duration.time(), metrics.span("image.prepare"):
+        image = await run_in_pool(
+            preprocess_image, path, IMAGE_MAX_DIMENSION, IMAGE_GRAYSCALE, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_MAX_PAGES
+        )
+    metrics.image_bytes.observe(image["original_bytes"], stage="original")
+    metrics.image_bytes.observe(image["sent_bytes"], stage="sent")
+    return image
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Optional
+
+from . import llm, metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+LLM_FALLBACK = os.getenv("LLM_FALLBACK", "true").lower() == "true"
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+CIRCUIT_WINDOW = int(os.getenv("LLM_CIRCUIT_WINDOW", "20"))
+CIRCUIT_MIN_CALLS = int(os.getenv("LLM_CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_ERROR_RATE = float(os.getenv("LLM_CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", "30"))
+LATENCY_WINDOW = 200
+
+KEY_COLUMNS = {"deepseek": "deepseek_api_key", "openai": "openai_api_key"}
+
+class ProviderUnavailable(Exception):
+    pass
+
+class Route:
+    def __init__(self, provider: str, model: str, api_key: Optional[str], base_url: Optional[str] = None):
+        self.provider = provider
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url or llm.PROVIDERS[provider]["base_url"]
+
+    @property
+    def name(self) -> str:
+        return self.provider if self.base_url == llm.PROVIDERS[self.provider]["base_url"] else f"{self.provider}@{self.base_url}"
+
+class Health:
+    """Recent latencies and outcomes of one endpoint, with a simple error-rate circuit breaker."""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.outcomes = deque(maxlen=CIRCUIT_WINDOW)
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.calls = 0
+        self.errors = 0
+
+    def available(self) -> bool:
+        if self.opened_at is None:
+            return True
+        return not self.probing and time.monotonic() - self.opened_at >= CIRCUIT_COOLDOWN_SECONDS
+
+    def begin(self):
+        if self.opened_at is not None:
+            # Half-open: let exactly one request through to test the provider.
+            self.probing = True
+
+    def success(self, latency: float):
+        self.calls += 1
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.opened_at = None
+        self.probing = False
+
+    def abandoned(self):
+        self.probing = False
+
+    def failure(self):
+        self.calls += 1
+        self.errors += 1
+        self.outcomes.append(False)
+        failures = self.outcomes.count(False)
+        if self.probing or (len(self.outcomes) >= CIRCUIT_MIN_CALLS and failures / len(self.outcomes) >= CIRCUIT_ERROR_RATE):
+            if self.opened_at is None or self.probing:
+                logger.warning("Opening LLM circuit after %d of %d failed calls", failures, len(self.outcomes))
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def hedge_delay(self) -> Optional[float]:
+        if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.percentile(95), LLM_HEDGE_MIN_DELAY)
+
+    def snapshot(self) -> dict:
+        return {
+            "state": "closed" if self.opened_at is None else ("half_open" if self.available() or self.probing else "open"),
+            "calls": self.calls,
+            "errors": self.errors,
+            "recent_error_rate": round(self.outcomes.count(False) / len(self.outcomes), 3) if self.outcomes else 0.0,
+            "p50_seconds": self.percentile(50),
+            "p95_seconds": self.percentile(95),
+        }
+
+_health = {}
+
+def health(route: Route) -> Health:
+    key = (route.provider, route.base_url)
+    if key not in _health:
+        _health[key] = Health()
+    return _health[key]
+
+def stats() -> dict:
+    return {
+        provider if base_url == llm.PROVIDERS[provider]["base_url"] else f"{provider}@{base_url}": entry.snapshot()
+        for (provider, base_url), entry in _health.items()
+    }
+
+def user_profile(settings=None) -> dict:
+    """Plain snapshot of a user's AI settings, safe to keep after the session closes."""
+    if settings is None:
+        provider = llm.default_provider()
+        return {"provider": provider, "model": llm.default_model(provider), "base_url": None, "api_keys": {}}
+    provider = (settings.ai_provider or llm.default_provider()).lower()
+    if provider not in llm.PROVIDERS:
+        provider = llm.default_provider()
+    return {
+        "provider": provider,
+        "model": settings.default_model or llm.default_model(provider),
+        "base_url": settings.base_url or None,
+        "api_keys": {name: getattr(settings, column) for name, column in KEY_COLUMNS.items() if getattr(settings, column)},
+    }
+
+def load_profile(db, owner_id: int) -> dict:
+    from .. import models
+
+    return user_profile(db.query(models.UserSettings).filter(models.UserSettings.user_id == owner_id).first())
+
+def _api_key(profile: dict, provider: str, base_url: Optional[str] = None) -> Optional[str]:
+    # The server's keys only ever go to the provider's own endpoint, never to a user-chosen base_url.
+    if llm.is_custom_base_url(provider, base_url):
+        return profile["api_keys"].get(provider)
+    return profile["api_keys"].get(provider) or os.getenv(llm.PROVIDERS[provider]["api_key_env"])
+
+def primary_route(profile: Optional[dict] = None) -> Route:
+    profile = profile or user_profile()
+    provider = profile["provider"]
+    return Route(provider, profile["model"], _api_key(profile, provider, profile["base_url"]), profile["base_url"])
+
+def routes(profile: Optional[dict] = None):
+    """The user's configured provider first, then the other providers that have a key, in declaration order."""
+    profile = profile or user_profile()
+    primary = primary_route(profile)
+    candidates = [primary] if primary.api_key else []
+    if LLM_FALLBACK:
+        for provider in llm.PROVIDERS:
+            api_key = _api_key(profile, provider)
+            if provider != primary.provider and api_key:
+                candidates.append(Route(provider, llm.default_model(provider), api_key))
+    return candidates
+
+def _retryable(exc: Exception) -> bool:
+    import openai  # already loaded by the client that raised; kept out of module import for fast startup
+
+    if isinstance(exc, (openai.APIConnectionError, openai.RateLimitError, asyncio.TimeoutError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+def backoff(attempt: int) -> float:
+    delay = min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, delay)
+
+async def _call(route: Route, kwargs: dict):
+    entry = health(route)
+    entry.begin()
+    client = llm.get_client(route.provider, route.api_key, route.base_url)
+    start = time.perf_counter()
+    try:
+        with metrics.span("llm.chat", provider=route.provider, model=route.model):
+            response = await client.chat.completions.create(model=route.model, **kwargs)
+    except asyncio.CancelledError:
+        entry.abandoned()
+        metrics.llm_request_duration.observe(time.perf_counter() - start, provider=route.name, model=route.model, outcome="cancelled")
+        raise
+    except Exception as e:
+        if _retryable(e):
+            entry.failure()
+        else:
+            # The provider answered (a bad request, a rejected key), which says nothing about its health;
+            # still end the probe, or the circuit would stay half-open with nothing let through.
+            entry.abandoned()
+        metrics.llm_request_duration.observe(time.perf_counter() - start, provider=route.name, model=route.model, outcome="error")
+        raise
+    elapsed = time.perf_counter() - start
+    entry.success(elapsed)
+    metrics.llm_request_duration.observe(elapsed, provider=route.name, model=route.model, outcome="ok")
+    _record_usage(route, response)
+    return route, response
+
+def _record_usage(route: Route, response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens:
+            metrics.llm_tokens.inc(tokens, provider=route.name, model=route.model, type=kind)
+    if usage.total_tokens:
+        metrics.llm_request_tokens.observe(usage.total_tokens, provider=route.name)
+
+@metrics.collector
+def _collect_circuits():
+    metrics.llm_circuit_open.replace({
+        (name,): int(snapshot["state"] == "open") for name, snapshot in stats().items()
+    })
+
+async def _hedged(primary: Route, backup: Optional[Route], kwargs: dict):
+    delay = health(primary).hedge_delay() if LLM_HEDGE else None
+    if delay is None:
+        return await _call(primary, kwargs)
+
+    first = asyncio.create_task(_call(primary, kwargs))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    logger.info("LLM request to %s exceeded p95 (%.2fs); sending a hedged request", primary.name, delay)
+    pending = {first, asyncio.create_task(_call(backup or primary, kwargs))}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def chat(profile: Optional[dict] = None, **kwargs):
+    """Run a chat completion on the healthiest route for this profile; returns (route, response)."""
+    candidates = routes(profile)
+    if not candidates:
+        raise ProviderUnavailable("No API key configured for any AI provider")
+
+    last_error = None
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        healthy = [route for route in candidates if health(route).available()]
+        if not healthy:
+            raise ProviderUnavailable(f"All AI providers are unavailable: {last_error or 'circuit open'}")
+        primary = healthy[0]
+        try:
+            return await _hedged(primary, healthy[1] if len(healthy) > 1 else None, kwargs)
+        except Exception as e:
+            last_error = e
+            # Prefer a different provider for the next attempt.
+            candidates.remove(primary)
+            if _retryable(e):
+                candidates.append(primary)
+            logger.warning("LLM request to %s failed (attempt %d): %s", primary.name, attempt + 1, e)
+            if not candidates:
+                break
+            if _retryable(e) and attempt + 1 < LLM_MAX_ATTEMPTS:
+                await asyncio.sleep(backoff(attempt))
+    raise last_error
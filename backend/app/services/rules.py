@@ -0,0 +1,180 @@
+import os
+import re
+from typing import Optional
+
+from .fields import parse_amount, parse_date
+
+RULES_ENABLED = os.getenv("RULES_ENABLED", "true").lower() == "true"
+RULES_MIN_CONFIDENCE = float(os.getenv("RULES_MIN_CONFIDENCE", "0.8"))
+LLM_FIELD_CONFIDENCE = float(os.getenv("LLM_FIELD_CONFIDENCE", "0.85"))
+# When every other field was found locally, keep the layout guesses for the seller header instead of calling the model.
+RULES_TRUST_HEADER = os.getenv("RULES_TRUST_HEADER", "true").lower() == "true"
+
+FIELDS = (
+    "customer_name", "customer_tin", "invoice_number", "invoice_date", "untaxed_amount",
+    "total_tax", "invoice_total", "company_name", "company_address", "company_tin",
+)
+AMOUNT_FIELDS = ("untaxed_amount", "total_tax", "invoice_total")
+HEADER_FIELDS = ("company_name", "company_address")
+
+_CURRENCY = r"(?:[A-Z]{3}\.?|MVR|Rf\.?|\$|€|£)?\s*"
+_AMOUNT = r"(-?\d{1,3}(?:,\d{3})+(?:\.\d+)?|-?\d+(?:\.\d+)?)"
+_DATE = (
+    r"(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}"
+    r"|\d{1,2}[ \-][A-Za-z]{3,9}[ \-,]+\d{2,4}|[A-Za-z]{3,9} \d{1,2},? \d{4})"
+)
+
+INVOICE_NUMBER = re.compile(
+    r"\b(?:tax\s+)?invoice\s*(?:no\.?|number|num\.?|#)\s*[:#.\-]?\s*([A-Z0-9][A-Z0-9\-/_.]{1,40})", re.IGNORECASE
+)
+INVOICE_DATE = re.compile(r"\b(?:invoice\s+|issue\s+|bill\s+)?date(?:\s+of\s+issue)?\s*[:\-]?\s*" + _DATE, re.IGNORECASE)
+TIN = re.compile(r"\b(?:TIN|tax\s+(?:identification\s+|id\s*)?(?:no\.?|number)|GST\s*(?:TIN|no\.?|reg(?:istration)?\.?\s*no\.?))"
+                 r"\s*[:#.\-]?\s*([A-Z0-9][A-Z0-9\-]{4,30})", re.IGNORECASE)
+CUSTOMER_SECTION = re.compile(r"\b(?:bill(?:ed)?\s+to|customer|sold\s+to|buyer|client)\b\s*(?:name)?\s*[:\-]?", re.IGNORECASE)
+SUBTOTAL = re.compile(
+    r"\b(?:sub\s*-?\s*total|untaxed\s+amount|total\s+before\s+tax|net\s+amount|total\s+excl\w*\.?(?:\s+\w+)?|amount\s+excl\w*\.?(?:\s+\w+)?)"
+    r"\s*[:\-]?\s*" + _CURRENCY + _AMOUNT, re.IGNORECASE
+)
+TAX = re.compile(
+    r"\b(?:total\s+tax|tax\s+amount|(?:gst|vat|tgst|sales\s+tax|tax)(?:\s*@?\s*\(?\d+(?:\.\d+)?\s*%\)?)?)"
+    r"\s*[:\-]?\s*" + _CURRENCY + _AMOUNT, re.IGNORECASE
+)
+TOTAL = re.compile(
+    r"(?<!sub)(?<!sub )(?<!sub-)\b(?:grand\s+total|invoice\s+total|total\s+amount(?:\s+due)?|amount\s+due|total\s+due|"
+    r"total(?:\s+incl\w*\.?(?:\s+\w+)?)?)\s*[:\-]?\s*" + _CURRENCY + _AMOUNT, re.IGNORECASE
+)
+
+def _last(pattern, text) -> Optional[re.Match]:
+    match = None
+    for match in pattern.finditer(text):
+        pass
+    return match
+
+def _amounts_consistent(untaxed: float, tax: float, total: float) -> bool:
+    return abs(untaxed + tax - total) <= max(0.011, abs(total) * 0.001)
+
+def _customer_name(text: str):
+    match = CUSTOMER_SECTION.search(text)
+    if not match:
+        return None
+    rest = text[match.end():].lstrip(" \t:-")
+    for line in rest.splitlines():
+        line = line.strip()
+        if line:
+            return line[:120]
+    return None
+
+HEADER_STOP = re.compile(r"invoice|page\s+\d|date|\btin\b|tax|gst|vat|bill|customer|sold\s+to|phone|tel\b|e-?mail|www\.", re.IGNORECASE)
+
+def _header(text: str):
+    """Company name and address from the lines above the first labelled line."""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if HEADER_STOP.search(line) or len(lines) == 3:
+            break
+        lines.append(line[:120])
+    if not lines:
+        return None, None
+    return lines[0], ", ".join(lines[1:]) or None
+
+def extract(text: str) -> dict:
+    """Extract what regexes and layout hints can find, as {field: (value, confidence)}."""
+    fields = {}
+    if not text or not text.strip():
+        return fields
+
+    match = INVOICE_NUMBER.search(text)
+    if match:
+        fields["invoice_number"] = (match.group(1).rstrip(".,"), 0.9)
+
+    match = INVOICE_DATE.search(text)
+    if match and parse_date(match.group(1)):
+        fields["invoice_date"] = (match.group(1), 0.9)
+
+    customer_start = CUSTOMER_SECTION.search(text)
+    for match in TIN.finditer(text):
+        in_customer_section = customer_start is not None and match.start() > customer_start.start()
+        field = "customer_tin" if in_customer_section else "company_tin"
+        if field not in fields:
+            fields[field] = (match.group(1), 0.85 if customer_start is not None else 0.6)
+
+    amounts = {}
+    for field, pattern in (("untaxed_amount", SUBTOTAL), ("total_tax", TAX), ("invoice_total", TOTAL)):
+        match = _last(pattern, text)
+        if match:
+            amounts[field] = parse_amount(match.group(1))
+    amounts = {field: value for field, value in amounts.items() if value is not None}
+
+    if len(amounts) == 3:
+        score = 0.98 if _amounts_consistent(amounts["untaxed_amount"], amounts["total_tax"], amounts["invoice_total"]) else 0.4
+        for field, value in amounts.items():
+            fields[field] = (value, score)
+    elif len(amounts) == 2 and "invoice_total" in amounts:
+        known = "untaxed_amount" if "untaxed_amount" in amounts else "total_tax"
+        derived = "total_tax" if known == "untaxed_amount" else "untaxed_amount"
+        value = round(amounts["invoice_total"] - amounts[known], 2)
+        score = 0.75 if value >= 0 else 0.3
+        fields["invoice_total"] = (amounts["invoice_total"], score)
+        fields[known] = (amounts[known], score)
+        fields[derived] = (value, score)
+    else:
+        for field, value in amounts.items():
+            fields[field] = (value, 0.6)
+
+    customer_name = _customer_name(text)
+    if customer_name:
+        fields["customer_name"] = (customer_name, 0.8)
+    company_name, company_address = _header(text)
+    if company_name:
+        fields["company_name"] = (company_name, 0.6)
+    if company_address:
+        fields["company_address"] = (company_address, 0.6)
+    return fields
+
+def accepted(fields: dict, threshold: float = RULES_MIN_CONFIDENCE) -> dict:
+    return {field: value for field, (value, score) in fields.items() if score >= threshold}
+
+def missing(fields: dict, threshold: float = RULES_MIN_CONFIDENCE) -> list:
+    """Fields the model still has to be asked for."""
+    found = accepted(fields, threshold)
+    gaps = [field for field in FIELDS if field not in found]
+    if RULES_TRUST_HEADER and all(field in HEADER_FIELDS and field in fields for field in gaps):
+        return []
+    return gaps
+
+def _same(a, b) -> bool:
+    if isinstance(a, (int, float)) or isinstance(b, (int, float)):
+        left, right = parse_amount(a), parse_amount(b)
+        return left is not None and right is not None and abs(left - right) < 0.01
+    return str(a).strip().lower() == str(b).strip().lower()
+
+def merge(rule_fields: dict, llm_data: dict, threshold: float = RULES_MIN_CONFIDENCE):
+    """Combine rule and LLM values into (data, overall confidence in [0, 1])."""
+    data = {}
+    scores = {}
+    for field in FIELDS:
+        rule_value, rule_score = rule_fields.get(field, (None, 0.0))
+        llm_value = llm_data.get(field)
+        if rule_value is not None and rule_score >= threshold:
+            data[field], scores[field] = rule_value, rule_score
+        elif llm_value not in (None, ""):
+            data[field] = llm_value
+            scores[field] = max(rule_score, 0.95) if rule_value is not None and _same(rule_value, llm_value) else LLM_FIELD_CONFIDENCE
+        elif rule_value is not None:
+            data[field], scores[field] = rule_value, rule_score
+        else:
+            data[field], scores[field] = None, 0.0
+
+    if data["invoice_date"] is not None and parse_date(data["invoice_date"]) is None:
+        scores["invoice_date"] = min(scores["invoice_date"], 0.5)
+
+    amounts = [parse_amount(data[field]) for field in AMOUNT_FIELDS]
+    if all(value is not None for value in amounts):
+        consistent = _amounts_consistent(*amounts)
+        for field in AMOUNT_FIELDS:
+            scores[field] = max(scores[field], 0.95) if consistent else min(scores[field], 0.5)
+
+    return data, round(sum(scores.values()) / len(FIELDS), 2)
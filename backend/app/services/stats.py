@@ -0,0 +1,147 @@
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import case, delete, event, func, inspect
+from sqlalchemy.orm import Session
+
+from .. import models
+
+STAT_COLUMNS = ("total", "completed", "failed", "confidence_sum")
+
+def month_key(value: datetime) -> str:
+    return value.strftime("%Y-%m")
+
+def recent_months(count: int, now: datetime = None):
+    now = now or datetime.utcnow()
+    year, month = now.year, now.month
+    keys = []
+    for _ in range(count):
+        keys.append(f"{year:04d}-{month:02d}")
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return list(reversed(keys))
+
+def _contribution(status, confidence):
+    completed = status == "completed"
+    return (1, int(completed), int(status == "failed"), (confidence or 0.0) if completed else 0.0)
+
+def _history_value(state, attr):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(state.obj(), attr)
+
+def _collect_deltas(session):
+    deltas = defaultdict(lambda: [0, 0, 0, 0.0])
+
+    def add(invoice, values, sign):
+        if invoice.owner_id is None:
+            return
+        delta = deltas[(invoice.owner_id, month_key(invoice.created_at))]
+        for i, value in enumerate(values):
+            delta[i] += sign * value
+
+    for obj in session.new:
+        if isinstance(obj, models.Invoice):
+            if obj.created_at is None:
+                obj.created_at = datetime.utcnow()
+            add(obj, _contribution(obj.status or "pending", obj.confidence), 1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, models.Invoice) or not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        if not (state.attrs.status.history.has_changes() or state.attrs.confidence.history.has_changes()):
+            continue
+        add(obj, _contribution(_history_value(state, "status"), _history_value(state, "confidence")), -1)
+        add(obj, _contribution(obj.status, obj.confidence), 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, models.Invoice):
+            state = inspect(obj)
+            add(obj, _contribution(_history_value(state, "status"), _history_value(state, "confidence")), -1)
+
+    return {key: delta for key, delta in deltas.items() if any(delta)}
+
+def _upsert(session, owner_id: int, month: str, delta):
+    table = models.InvoiceMonthlyStats.__table__
+    values = dict(zip(STAT_COLUMNS, delta))
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        stmt = insert(table).values(owner_id=owner_id, month=month, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["owner_id", "month"],
+            set_={name: table.c[name] + stmt.excluded[name] for name in STAT_COLUMNS}
+        )
+        session.execute(stmt)
+        return
+
+    updated = session.execute(
+        table.update().where(table.c.owner_id == owner_id, table.c.month == month).values(
+            **{name: table.c[name] + value for name, value in values.items()}
+        )
+    ).rowcount
+    if not updated:
+        session.execute(table.insert().values(owner_id=owner_id, month=month, **values))
+
+@event.listens_for(Session, "before_flush")
+def _maintain_rollup(session, flush_context, instances):
+    for (owner_id, month), delta in _collect_deltas(session).items():
+        _upsert(session, owner_id, month, delta)
+
+def _month_expression(dialect: str):
+    if dialect == "postgresql":
+        return func.to_char(models.Invoice.created_at, "YYYY-MM")
+    return func.strftime("%Y-%m", models.Invoice.created_at)
+
+def rebuild(db, owner_id: int = None):
+    """Recompute the rollup from the invoices table with one grouped query."""
+    month = _month_expression(db.get_bind().dialect.name).label("month")
+    query = db.query(
+        models.Invoice.owner_id,
+        month,
+        func.count(models.Invoice.id),
+        func.sum(case((models.Invoice.status == "completed", 1), else_=0)),
+        func.sum(case((models.Invoice.status == "failed", 1), else_=0)),
+        func.sum(case((models.Invoice.status == "completed", models.Invoice.confidence), else_=0.0))
+    ).filter(models.Invoice.owner_id.isnot(None)).group_by(models.Invoice.owner_id, month)
+    stale = delete(models.InvoiceMonthlyStats)
+    if owner_id is not None:
+        query = query.filter(models.Invoice.owner_id == owner_id)
+        stale = stale.where(models.InvoiceMonthlyStats.owner_id == owner_id)
+
+    rows = query.all()
+    db.execute(stale)
+    db.bulk_insert_mappings(models.InvoiceMonthlyStats, [
+        {"owner_id": row[0], "month": row[1], "total": row[2], "completed": row[3] or 0,
+         "failed": row[4] or 0, "confidence_sum": row[5] or 0.0}
+        for row in rows
+    ])
+    db.commit()
+
+def summary(db, owner_id: int, months: int = 6) -> dict:
+    rows = db.query(models.InvoiceMonthlyStats).filter(
+        models.InvoiceMonthlyStats.owner_id == owner_id
+    ).all()
+    total = sum(row.total for row in rows)
+    completed = sum(row.completed for row in rows)
+    failed = sum(row.failed for row in rows)
+    confidence_sum = sum(row.confidence_sum for row in rows)
+    by_month = {row.month: row.total for row in rows}
+
+    return {
+        "total_invoices": total,
+        "completed_invoices": completed,
+        "failed_invoices": failed,
+        "average_confidence": round(confidence_sum / completed, 2) if completed else 0,
+        "success_rate": round(completed / total * 100, 1) if total else 0,
+        "monthly_data": [{"month": key, "count": by_month.get(key, 0)} for key in recent_months(months)]
+    }
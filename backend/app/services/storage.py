@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import os
+import time
+
+from fastapi import UploadFile
+
+from . import blobs, metrics
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+FILE_SIGNATURES = {
+    ".pdf": (b"%PDF-",),
+    ".png": (b"\x89PNG\r\n\x1a\n",),
+    ".jpg": (b"\xff\xd8\xff",),
+    ".jpeg": (b"\xff\xd8\xff",),
+    ".tiff": (b"II*\x00", b"MM\x00*"),
+}
+
+class UploadError(Exception):
+    pass
+
+class InvalidUpload(UploadError):
+    pass
+
+class UploadTooLarge(UploadError):
+    pass
+
+def _write_chunk(f, digest, chunk: bytes):
+    digest.update(chunk)
+    f.write(chunk)
+
+def _discard(f, path: str):
+    f.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+async def save_upload(file: UploadFile, dest: str, max_bytes: int = MAX_UPLOAD_BYTES):
+    """Copy an upload to dest in fixed-size chunks, returning (size, sha256 hex digest)."""
+    signatures = FILE_SIGNATURES.get(os.path.splitext(file.filename.lower())[1])
+    if signatures is None:
+        metrics.uploads_rejected.inc(reason="type")
+        raise InvalidUpload("Invalid file type")
+
+    start = time.perf_counter()
+    partial = f"{dest}.part"
+    digest = hashlib.sha256()
+    size = 0
+    f = await asyncio.to_thread(open, partial, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0 and not chunk.startswith(signatures):
+                raise InvalidUpload("File content does not match its type")
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"File exceeds the {max_bytes // (1024 * 1024)} MB limit")
+            await asyncio.to_thread(_write_chunk, f, digest, chunk)
+        if size == 0:
+            raise InvalidUpload("File is empty")
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, partial, dest)
+    except BaseException as e:
+        await asyncio.to_thread(_discard, f, partial)
+        if isinstance(e, UploadError):
+            metrics.uploads_rejected.inc(reason="too_large" if isinstance(e, UploadTooLarge) else "content")
+        raise
+    metrics.upload_write_duration.observe(time.perf_counter() - start)
+    metrics.upload_bytes.observe(size)
+    return size, digest.hexdigest()
+
+async def store_uploads(files, max_bytes: int = MAX_UPLOAD_BYTES) -> list:
+    """Save uploads into the blob store, registering them all in one transaction.
+
+    Returns one entry per file, in order: (Invoice.filepath reference, sha256 hex digest), or the
+    UploadError that rejected that file. One bad file never affects the others.
+    """
+    outcomes = []
+    staged = []
+    try:
+        for file in files:
+            ext = os.path.splitext(file.filename.lower())[1]
+            temp = await asyncio.to_thread(blobs.temp_path, ext)
+            try:
+                size, content_hash = await save_upload(file, temp, max_bytes)
+            except UploadError as e:
+                outcomes.append(e)
+                continue
+            staged.append((len(outcomes), temp, blobs.blob_key(content_hash, ext), content_hash, size))
+            outcomes.append(None)
+        stored = await asyncio.to_thread(blobs.store_many, [item[1:] for item in staged])
+    except BaseException:
+        await asyncio.to_thread(_remove_files, [item[1] for item in staged])
+        raise
+
+    for (index, temp, key, content_hash, _), result in zip(staged, stored):
+        if isinstance(result, Exception):
+            await asyncio.to_thread(_remove_files, [temp])
+            metrics.uploads_rejected.inc(reason="storage")
+            outcomes[index] = UploadError("Could not store file")
+        else:
+            outcomes[index] = (blobs.reference(key), content_hash)
+    return outcomes
+
+def _remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,9 @@
+"""gunicorn worker class for gunicorn.conf.py; only imported when running under gunicorn."""
+from uvicorn.workers import UvicornWorker
+
+class Worker(UvicornWorker):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Close lingering event streams early enough for the lifespan shutdown to requeue in-flight jobs
+        # before gunicorn's graceful_timeout kills the worker.
+        self.config.timeout_graceful_shutdown = max(1, self.cfg.graceful_timeout - 5)
@@ -0,0 +1,52 @@
+"""Per-request cost of resolving the bearer token to a user.
+
+Run from backend/: python -m benchmarks.auth_overhead [iterations]
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/auth_bench.db")
+
+from app import models, auth, database  # noqa: E402
+
+def _time(label, fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    per_call = (time.perf_counter() - start) / iterations * 1e6
+    print(f"{label:<34} {per_call:9.1f} us/request")
+    return per_call
+
+def main(iterations: int = 5000):
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    user = db.query(models.User).filter(models.User.username == "bench").first()
+    if user is None:
+        user = models.User(email="bench@example.com", username="bench", hashed_password="x")
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+
+    by_username = auth.create_access_token({"sub": user.username})
+    by_id = auth.create_access_token({"sub": user.username, "uid": user.id})
+
+    def uncached(token):
+        def run():
+            auth.user_cache.clear()
+            auth.get_current_user(token, db)
+        return run
+
+    def cached(token):
+        return lambda: auth.get_current_user(token, db)
+
+    baseline = _time("lookup by username (no cache)", uncached(by_username), iterations)
+    _time("lookup by primary key (no cache)", uncached(by_id), iterations)
+    best = _time("cached principal", cached(by_id), iterations)
+    print(f"speedup vs baseline: {baseline / best:.1f}x")
+    db.close()
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
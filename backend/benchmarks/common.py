@@ -0,0 +1,145 @@
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(latencies) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+def _wait_healthy(proc, base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if httpx.get(f"{base_url}/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if proc.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError(f"Server at {base_url} failed to start")
+        time.sleep(0.1)
+
+@contextlib.contextmanager
+def _serve(command, port: int, env: dict, cwd: str):
+    proc = subprocess.Popen(command, cwd=cwd, env={**os.environ, "PYTHONPATH": str(BACKEND_DIR), **env})
+    try:
+        proc.base_url = f"http://127.0.0.1:{port}"
+        _wait_healthy(proc, proc.base_url)
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+def _uvicorn(app_path: str, env: dict, cwd: str):
+    port = free_port()
+    command = [sys.executable, "-m", "uvicorn", app_path, "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning"]
+    return _serve(command, port, env, cwd)
+
+@contextlib.contextmanager
+def run_server(env: dict = None, workdir: str = None):
+    """Start the API under uvicorn in a scratch directory and yield its process (with .base_url)."""
+    workdir = workdir or tempfile.mkdtemp(prefix="invoice-bench-")
+    server_env = {
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "JOB_WORKERS": "0",
+        **(env or {}),
+    }
+    with _uvicorn("app.main:app", server_env, workdir) as proc:
+        yield proc
+
+@contextlib.contextmanager
+def run_gunicorn(env: dict = None, workdir: str = None, workers: int = 2):
+    """Like run_server, but through gunicorn.conf.py with its pre-start step, as the Dockerfile runs it."""
+    workdir = workdir or tempfile.mkdtemp(prefix="invoice-bench-")
+    port = free_port()
+    server_env = {
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "JOB_WORKERS": "0",
+        "WEB_CONCURRENCY": str(workers),
+        "BIND": f"127.0.0.1:{port}",
+        **(env or {}),
+    }
+    subprocess.run([sys.executable, "-m", "app.prestart"], cwd=workdir, check=True, capture_output=True,
+                   env={**os.environ, "PYTHONPATH": str(BACKEND_DIR), **server_env})
+    command = [sys.executable, "-m", "gunicorn", "-c", str(BACKEND_DIR / "gunicorn.conf.py"), "--log-level", "warning",
+               "app.main:app"]
+    with _serve(command, port, server_env, workdir) as proc:
+        yield proc
+
+@contextlib.contextmanager
+def run_stub_llm(latency_ms: float = 500, sigma: float = 0.4, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 invalid_json_rate: float = 0.0):
+    """Start benchmarks.stub_llm and yield its process; point OPENAI_BASE_URL at f"{proc.base_url}/v1"."""
+    env = {
+        "STUB_LATENCY_MS": str(latency_ms),
+        "STUB_LATENCY_SIGMA": str(sigma),
+        "STUB_ERROR_RATE": str(error_rate),
+        "STUB_RATE_LIMIT_RATE": str(rate_limit_rate),
+        "STUB_INVALID_JSON_RATE": str(invalid_json_rate),
+    }
+    with _uvicorn("benchmarks.stub_llm:app", env, str(BACKEND_DIR)) as proc:
+        yield proc
+
+def reset_peak_rss(pid: int) -> bool:
+    """Reset the kernel's high-water mark so VmHWM covers only what follows (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "."], cwd=BACKEND_DIR, capture_output=True,
+                               text=True).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def register_and_login(client: httpx.Client, username: str, password: str = "bench-password") -> dict:
+    client.post("/auth/register", json={"email": f"{username}@example.com", "username": username, "password": password})
+    response = client.post("/auth/login", data={"username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
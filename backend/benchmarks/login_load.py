@@ -0,0 +1,76 @@
+"""Login burst against a running API while other users keep reading their invoices and stats.
+
+Run from backend/: python -m benchmarks.login_load [--logins 100] [--concurrency 50]
+Compare PASSWORD_HASH_WORKERS / BCRYPT_ROUNDS settings by exporting them before running.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from .common import register_and_login, run_server, summarize
+
+async def _login_burst(base_url, users, total, concurrency, latencies, rejected):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/auth/login", data={"username": users[i % len(users)], "password": "bench-password"})
+                if response.status_code == 503:
+                    rejected.append(1)
+                else:
+                    latencies.append(time.perf_counter() - start)
+        await asyncio.gather(*(one(i) for i in range(total)))
+
+async def _reader(base_url, headers, stop, list_latencies, stats_latencies):
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=300) as client:
+        while not stop.is_set():
+            for path, bucket in (("/invoices", list_latencies), ("/users/stats", stats_latencies)):
+                start = time.perf_counter()
+                await client.get(path)
+                bucket.append(time.perf_counter() - start)
+
+async def _run(base_url, users, headers, args):
+    login, rejected, listing, stats = [], [], [], []
+    stop = asyncio.Event()
+    readers = [asyncio.create_task(_reader(base_url, headers, stop, listing, stats)) for _ in range(args.readers)]
+    await asyncio.sleep(0.5)
+    baseline_list, baseline_stats = summarize(listing), summarize(stats)
+    listing.clear()
+    stats.clear()
+    start = time.perf_counter()
+    await _login_burst(base_url, users, args.logins, args.concurrency, login, rejected)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*readers)
+    return {
+        "login": {**summarize(login), "rejected": len(rejected), "logins_per_s": round(len(login) / elapsed, 1)},
+        "list_idle": baseline_list,
+        "list_during_burst": summarize(listing),
+        "stats_idle": baseline_stats,
+        "stats_during_burst": summarize(stats),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    with run_server() as server:
+        with httpx.Client(base_url=server.base_url, timeout=300) as client:
+            users = [f"login-bench-{i}" for i in range(args.users)]
+            for username in users:
+                register_and_login(client, username)
+            headers = register_and_login(client, "login-bench-reader")
+        results = asyncio.run(_run(server.base_url, users, headers, args))
+
+    for name, summary in results.items():
+        print(f"{name:<20} {summary}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""What a repeat view of the dashboard costs: the invoice list, a detail and /users/stats, fetched again.
+
+A scratch SQLite database is seeded with --invoices completed invoices. Each endpoint is then requested
+plainly, with its previous validator (If-None-Match, answered by a 304) and with gzip/brotli negotiated,
+reporting median latency and the bytes on the wire.
+
+Run from backend/:
+    python -m benchmarks.repeat_views --invoices 10000 --page-size 500
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from .common import git_revision, register_and_login, run_server
+from .serialization import seed
+
+def measure(client: httpx.Client, path: str, headers: dict, requests: int) -> dict:
+    latencies = []
+    wire = status = None
+    for _ in range(requests):
+        start = time.perf_counter()
+        with client.stream("GET", path, headers=headers) as response:
+            wire = sum(len(chunk) for chunk in response.iter_raw())
+            status = response.status_code
+        latencies.append(time.perf_counter() - start)
+    return {"status": status, "p50_ms": round(statistics.median(latencies) * 1000, 2), "wire_bytes": wire}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invoices", type=int, default=10000)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and variant")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="invoice-bench-")
+    database_url = f"sqlite:///{workdir}/bench.db"
+    results = {}
+    with run_server({"DATABASE_URL": database_url}, workdir=workdir) as server:
+        with httpx.Client(base_url=server.base_url, timeout=300) as client:
+            auth = register_and_login(client, "repeat-views")
+            owner_id = client.get("/auth/me", headers=auth).json()["id"]
+            seed(database_url, owner_id, args.invoices)
+
+            paths = {"list": f"/invoices?limit={args.page_size}", "detail": "/invoices/1", "stats": "/users/stats"}
+            for name, path in paths.items():
+                plain = {**auth, "Accept-Encoding": "identity"}
+                etag = client.get(path, headers=plain).headers.get("etag")
+                variants = {
+                    "identity": plain,
+                    "gzip": {**auth, "Accept-Encoding": "gzip"},
+                    "br": {**auth, "Accept-Encoding": "br"},
+                    "revalidated": {**plain, "If-None-Match": etag},
+                }
+                results[name] = {variant: measure(client, path, headers, args.requests)
+                                 for variant, headers in variants.items()}
+                for variant, summary in results[name].items():
+                    print(f"{name:<7} {variant:<12} {summary}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"revision": git_revision(), "invoices": args.invoices, "endpoints": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Per-row cost of the invoice list and detail endpoints as the table grows.
+
+For each size, a scratch SQLite database is seeded with that many completed invoices for one user.
+The benchmark then walks the whole list through cursor pagination and fetches a sample of details
+over HTTP, reporting microseconds per listed row and milliseconds per detail request.
+
+Run from backend/:
+    python -m benchmarks.serialization --sizes 1000,10000,100000
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine, insert
+
+from .common import git_revision, register_and_login, run_server
+
+def _rows(owner_id: int, count: int, seed: int):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    for index in range(count):
+        total = round(rng.uniform(10, 5000), 2)
+        data = {
+            "customer_name": f"Customer {rng.randrange(500)}",
+            "customer_tin": f"TIN{rng.randrange(10 ** 6):06d}",
+            "invoice_number": f"INV-{index:07d}",
+            "invoice_date": (date(2024, 1, 1) + timedelta(days=rng.randrange(365))).isoformat(),
+            "untaxed_amount": round(total / 1.08, 2),
+            "total_tax": round(total - total / 1.08, 2),
+            "invoice_total": total,
+            "company_name": "Supplier Pvt Ltd",
+            "company_address": f"{rng.randrange(1, 300)} Main Street, Male",
+            "company_tin": "TIN000001",
+        }
+        created_at = start + timedelta(seconds=index * 30)
+        yield {
+            "filename": f"invoice-{index}.pdf",
+            "filepath": f"uploads/bench/invoice-{index}.pdf",
+            "extracted_data": json.dumps(data),
+            "customer_name": data["customer_name"],
+            "customer_tin": data["customer_tin"],
+            "invoice_number": data["invoice_number"],
+            "invoice_date": date.fromisoformat(data["invoice_date"]),
+            "untaxed_amount": data["untaxed_amount"],
+            "total_tax": data["total_tax"],
+            "invoice_total": total,
+            "company_name": data["company_name"],
+            "company_address": data["company_address"],
+            "company_tin": data["company_tin"],
+            "status": "completed",
+            "confidence": round(rng.uniform(0.6, 1.0), 2),
+            "created_at": created_at,
+            "updated_at": created_at,
+            "owner_id": owner_id,
+        }
+
+def seed(database_url: str, owner_id: int, count: int, seed: int = 0):
+    from app import models
+
+    engine = create_engine(database_url)
+    rows = _rows(owner_id, count, seed)
+    with engine.begin() as conn:
+        while True:
+            chunk = [row for _, row in zip(range(5000), rows)]
+            if not chunk:
+                break
+            conn.execute(insert(models.Invoice.__table__), chunk)
+    engine.dispose()
+
+def walk_list(client: httpx.Client, headers: dict, page_size: int):
+    rows = 0
+    pages = []
+    cursor = None
+    start = time.perf_counter()
+    while True:
+        params = {"limit": page_size, **({"cursor": cursor} if cursor else {})}
+        page_start = time.perf_counter()
+        response = client.get("/invoices", headers=headers, params=params)
+        response.raise_for_status()
+        pages.append(time.perf_counter() - page_start)
+        rows += len(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    return rows, time.perf_counter() - start, pages
+
+def run_size(count: int, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="invoice-bench-")
+    database_url = f"sqlite:///{workdir}/bench.db"
+    with run_server({"DATABASE_URL": database_url}, workdir=workdir) as server:
+        with httpx.Client(base_url=server.base_url, timeout=300) as client:
+            headers = register_and_login(client, "serialization")
+            owner_id = client.get("/auth/me", headers=headers).json()["id"]
+            seed(database_url, owner_id, count)
+
+            walk_list(client, headers, args.page_size)  # warm the page cache and the server
+            walks = [walk_list(client, headers, args.page_size) for _ in range(args.repeat)]
+            rows = walks[0][0]
+            seconds = statistics.median(walk[1] for walk in walks)
+            pages = [page for walk in walks for page in walk[2]]
+
+            ids = random.Random(1).sample(range(1, count + 1), min(args.details, count))
+            details = []
+            for invoice_id in ids:
+                start = time.perf_counter()
+                client.get(f"/invoices/{invoice_id}", headers=headers).raise_for_status()
+                details.append(time.perf_counter() - start)
+    return {
+        "rows": rows,
+        "list_us_per_row": round(seconds / rows * 1e6, 1),
+        "list_page_p50_ms": round(statistics.median(pages) * 1000, 1),
+        "detail_p50_ms": round(statistics.median(details) * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3, help="full list walks per size (the median is reported)")
+    parser.add_argument("--details", type=int, default=500, help="detail requests per size")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for count in (int(value) for value in args.sizes.split(",")):
+        results[count] = run_size(count, args)
+        print(f"{count:>7} invoices  {results[count]}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"revision": git_revision(), "sizes": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
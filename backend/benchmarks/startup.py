@@ -0,0 +1,122 @@
+"""Cold-start cost: importing the app, booting a server until /health answers, and the first requests.
+
+Each round uses a fresh process and a scratch SQLite database. Reported values are medians, with
+warm-up (STARTUP_WARMUP) on and off so its effect on readiness and first-request latency shows.
+
+Run from backend/:
+    python -m benchmarks.startup --rounds 5
+    python -m benchmarks.startup --server gunicorn --workers 4 --output startup.json
+    python -m benchmarks.startup --imports 15    # slowest modules by cumulative import time
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from .common import BACKEND_DIR, git_revision, run_gunicorn, run_server
+from .synthetic import make_pdf
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+def _env(workdir: str) -> dict:
+    return {**os.environ, "PYTHONPATH": str(BACKEND_DIR), "DATABASE_URL": f"sqlite:///{workdir}/startup.db"}
+
+def import_seconds() -> float:
+    workdir = tempfile.mkdtemp(prefix="invoice-bench-")
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=workdir, env=_env(workdir),
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def slowest_imports(count: int):
+    workdir = tempfile.mkdtemp(prefix="invoice-bench-")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=workdir,
+                            env=_env(workdir), capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only modules imported directly by app code, so nested dependencies are not double counted.
+        if name.startswith(" ") and len(name) - len(name.lstrip()) <= 3:
+            rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+def boot(runner, env: dict) -> dict:
+    start = time.perf_counter()
+    with runner(env) as server:
+        boot_s = time.perf_counter() - start
+        with httpx.Client(base_url=server.base_url, timeout=60) as client:
+            client.post("/auth/register", json={"email": "cold@example.com", "username": "cold", "password": "cold-password"})
+            start = time.perf_counter()
+            response = client.post("/auth/login", data={"username": "cold", "password": "cold-password"})
+            login_ms = (time.perf_counter() - start) * 1000
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            start = time.perf_counter()
+            client.get("/invoices", headers=headers).raise_for_status()
+            list_ms = (time.perf_counter() - start) * 1000
+            extract_ms = first_extraction_ms(client, headers) if env.get("JOB_WORKERS", "0") != "0" else None
+    return {"boot_s": boot_s, "first_login_ms": login_ms, "first_list_ms": list_ms, "first_extract_ms": extract_ms}
+
+def first_extraction_ms(client: httpx.Client, headers: dict, timeout: float = 60) -> float:
+    # A PDF the local rules extract fully, so the number covers the parser processes and not the LLM.
+    start = time.perf_counter()
+    response = client.post("/invoices/upload", headers=headers, data={"process": "true"},
+                           files=[("files", ("cold.pdf", make_pdf(0, True)))])
+    invoice_id = response.json()["results"][0]["id"]
+    while time.perf_counter() - start < timeout:
+        if client.get(f"/invoices/{invoice_id}", headers=headers).json()["status"] in ("completed", "failed"):
+            return (time.perf_counter() - start) * 1000
+        time.sleep(0.02)
+    raise RuntimeError("The first extraction did not finish")
+
+def _median(rounds, key: str, digits: int):
+    values = [item[key] for item in rounds if item[key] is not None]
+    return round(statistics.median(values), digits) if values else None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--server", choices=("uvicorn", "gunicorn"), default="uvicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--job-workers", type=int, default=4, help="JOB_WORKERS; parser processes are warmed only when > 0")
+    parser.add_argument("--imports", type=int, default=0, help="also list the N slowest imports")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.server == "gunicorn":
+        def runner(env):
+            return run_gunicorn(env, workers=args.workers)
+    else:
+        runner = run_server
+
+    imports = [import_seconds() for _ in range(args.rounds)]
+    results = {"import_s": round(statistics.median(imports), 3)}
+    print(f"import app.main     {results['import_s']:.3f}s")
+    for warmup in ("true", "false"):
+        env = {"STARTUP_WARMUP": warmup, "JOB_WORKERS": str(args.job_workers)}
+        rounds = [boot(runner, env) for _ in range(args.rounds)]
+        results[f"warmup_{warmup}"] = summary = {
+            "boot_s": _median(rounds, "boot_s", 3),
+            "first_login_ms": _median(rounds, "first_login_ms", 1),
+            "first_list_ms": _median(rounds, "first_list_ms", 1),
+            "first_extract_ms": _median(rounds, "first_extract_ms", 1),
+        }
+        print(f"warm-up {warmup:<5}       {summary}")
+
+    if args.imports:
+        print("\nslowest imports (cumulative)")
+        for seconds, name in slowest_imports(args.imports):
+            print(f"  {seconds:7.3f}s  {name}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"revision": git_revision(), "server": args.server, **results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""OpenAI-compatible /v1/chat/completions stub with configurable latency and error distributions.
+
+Run standalone: STUB_LATENCY_MS=800 STUB_ERROR_RATE=0.02 python -m uvicorn benchmarks.stub_llm:app --port 8765
+Latency is lognormal around STUB_LATENCY_MS (median) with STUB_LATENCY_SIGMA spread, capped at STUB_LATENCY_MAX_MS.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "500"))
+LATENCY_SIGMA = float(os.getenv("STUB_LATENCY_SIGMA", "0.4"))
+LATENCY_MAX_MS = float(os.getenv("STUB_LATENCY_MAX_MS", "30000"))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+RATE_LIMIT_RATE = float(os.getenv("STUB_RATE_LIMIT_RATE", "0"))
+INVALID_JSON_RATE = float(os.getenv("STUB_INVALID_JSON_RATE", "0"))
+
+app = FastAPI()
+counters = {"requests": 0, "errors": 0, "rate_limited": 0, "invalid_json": 0, "batched_invoices": 0}
+
+BATCH_MARKER = re.compile(r"=== Invoice (\S+) ===")
+FIELD_LINE = re.compile(r"^- (\w+):", re.MULTILINE)
+
+def sample_latency() -> float:
+    if LATENCY_MS <= 0:
+        return 0.0
+    value = LATENCY_MS * math.exp(random.gauss(0, LATENCY_SIGMA))
+    return min(value, LATENCY_MAX_MS) / 1000
+
+def fake_fields(fields, seed) -> dict:
+    rng = random.Random(seed)
+    untaxed = round(rng.uniform(50, 5000), 2)
+    tax = round(untaxed * 0.08, 2)
+    values = {
+        "customer_name": f"Customer {rng.randint(1, 999)}",
+        "customer_tin": f"10{rng.randint(10000, 99999)}GST501",
+        "invoice_number": f"INV-{rng.randint(1000, 99999)}",
+        "invoice_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "untaxed_amount": untaxed,
+        "total_tax": tax,
+        "invoice_total": round(untaxed + tax, 2),
+        "company_name": "Stub Supplies Pvt Ltd",
+        "company_address": "1 Benchmark Road",
+        "company_tin": "1001234GST501",
+    }
+    return {field: values.get(field) for field in fields or values}
+
+def _prompt_text(messages) -> str:
+    content = messages[-1]["content"] if messages else ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["requests"] += 1
+    await asyncio.sleep(sample_latency())
+
+    roll = random.random()
+    if roll < ERROR_RATE:
+        counters["errors"] += 1
+        return JSONResponse({"error": {"message": "stub upstream error", "type": "server_error"}}, status_code=500)
+    if roll < ERROR_RATE + RATE_LIMIT_RATE:
+        counters["rate_limited"] += 1
+        return JSONResponse({"error": {"message": "stub rate limit", "type": "rate_limit"}}, status_code=429)
+
+    prompt = _prompt_text(body.get("messages", []))
+    fields = FIELD_LINE.findall(prompt)
+    invoice_ids = BATCH_MARKER.findall(prompt)
+    if invoice_ids:
+        counters["batched_invoices"] += len(invoice_ids)
+        content = json.dumps([{"invoice_id": invoice_id, **fake_fields(fields, invoice_id)} for invoice_id in invoice_ids])
+    else:
+        content = json.dumps(fake_fields(fields, hash(prompt)))
+    if random.random() < INVALID_JSON_RATE:
+        counters["invalid_json"] += 1
+        content = content[: len(content) // 2]
+
+    prompt_tokens = len(prompt) // 4 + 30
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"stub-{counters['requests']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+@app.get("/stats")
+def stats():
+    return counters
+
+@app.get("/health")
+def health():
+    return {"status": "healthy"}
@@ -0,0 +1,90 @@
+"""Synthetic invoice files: text-layer PDFs (complete or partial field sets) and scanned-style images."""
+import random
+from io import BytesIO
+
+def _pdf(lines) -> bytes:
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    stream = "\n".join(["BT /F1 11 Tf 14 TL 50 780 Td"] + [f"({escape(line)}) Tj T*" for line in lines] + ["ET"]).encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+def invoice_lines(rng: random.Random, complete: bool = True, items: int = 8):
+    untaxed = 0.0
+    rows = []
+    for n in range(items):
+        quantity, price = rng.randint(1, 20), round(rng.uniform(5, 400), 2)
+        untaxed += quantity * price
+        rows.append(f"Item {n + 1} - Widget {rng.randint(100, 999)}   {quantity} x {price:.2f}   {quantity * price:,.2f}")
+    untaxed = round(untaxed, 2)
+    tax = round(untaxed * 0.08, 2)
+
+    lines = [
+        f"Supplier {rng.randint(1, 300)} Pvt Ltd",
+        f"{rng.randint(1, 99)} Orchid Magu, Male",
+        f"TIN: 100{rng.randint(1000, 9999)}GST501",
+        "TAX INVOICE",
+        f"Invoice No: INV-{rng.randint(10000, 99999)}",
+        f"Invoice Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024",
+        "Bill To:",
+        f"Customer {rng.randint(1, 5000)} Resort",
+        f"TIN: 109{rng.randint(1000, 9999)}GST502",
+        *rows,
+        f"Sub Total: MVR {untaxed:,.2f}",
+        f"GST 8%: {tax:,.2f}",
+        f"Total: MVR {untaxed + tax:,.2f}",
+    ]
+    if not complete:
+        # Drop the customer block and subtotal so the rules leave gaps for the model.
+        lines = [line for line in lines if not line.startswith(("Bill To", "Customer", "TIN: 109", "Sub Total"))]
+    return lines
+
+def make_pdf(seed: int, complete: bool = True) -> bytes:
+    return _pdf(invoice_lines(random.Random(seed), complete))
+
+def make_image(seed: int, size=(1240, 1754), fmt: str = "PNG") -> bytes:
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    y = 60
+    for line in invoice_lines(rng, complete=True):
+        draw.text((60, y), line, fill="black")
+        y += 28
+    # Light noise so the encoder has scan-like content to chew on.
+    for _ in range(4000):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.point((x, y), fill=(rng.randint(180, 255),) * 3)
+    buffer = BytesIO()
+    image.save(buffer, fmt)
+    return buffer.getvalue()
+
+def make_files(count: int, image_ratio: float = 0.2, complete_ratio: float = 0.5, seed: int = 0):
+    """[(filename, bytes)] mixing complete PDFs, partial PDFs and images."""
+    rng = random.Random(seed)
+    files = []
+    for index in range(count):
+        roll = rng.random()
+        if roll < image_ratio:
+            files.append((f"scan-{seed}-{index}.png", make_image(seed * 100000 + index)))
+        else:
+            complete = rng.random() < complete_ratio
+            files.append((f"invoice-{seed}-{index}.pdf", make_pdf(seed * 100000 + index, complete)))
+    return files
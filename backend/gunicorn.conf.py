@@ -0,0 +1,52 @@
+"""Production server: python -m app.prestart && gunicorn -c gunicorn.conf.py app.main:app
+
+One uvicorn worker per available CPU (WEB_CONCURRENCY overrides). The app is imported once in the
+master and forked, so workers share its modules instead of each importing them again.
+
+Every worker serves requests, but only one runs the extraction queue: its JOB_WORKERS tasks, the
+PARSE_WORKERS parser processes and queue maintenance. Those limits therefore apply per server, not per
+worker. The queue worker holds a file lock; if it exits, another worker takes over.
+"""
+import os
+import tempfile
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))  # honours taskset and container cpusets
+    except AttributeError:
+        return os.cpu_count() or 1
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY") or _available_cpus())
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "20"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+
+# Schema setup belongs to app.prestart; workers only warm up.
+os.environ.setdefault("DB_SETUP_ON_STARTUP", "false")
+if workers > 1:
+    # Subscribers live in whichever worker holds their stream, so events have to travel through the database.
+    os.environ.setdefault("EVENTS_BACKEND", "database")
+    # Named after this master, so a second server on the same host elects its own queue worker.
+    os.environ.setdefault("JOB_QUEUE_LOCK", os.path.join(tempfile.gettempdir(), f"invoice-job-queue-{os.getpid()}.lock"))
+
+worker_class = "app.workers.Worker"
+
+def on_starting(server):
+    if preload_app:
+        from app.main import preload
+
+        preload()
+
+def post_fork(server, worker):
+    from app import database
+
+    # The forked pool must not reuse the master's sockets; close=False leaves them to the master.
+    database.engine.dispose(close=False)
+
+def on_exit(server):
+    lock = os.environ.get("JOB_QUEUE_LOCK")
+    if lock and os.path.exists(lock):
+        os.remove(lock)
@@ -10,7 +10,7 @@ const COLORS = ['#10B981', '#EF4444', '#F59E0B'];
 export default function Dashboard() {
   const [stats, setStats] = useState(null);
   const [invoices, setInvoices] = useState([]);
-  const { user, logout } = useAuth();
+  const { user, token, logout } = useAuth();
 
   const fetchData = async () => {
     try {
@@ -29,6 +29,23 @@ export default function Dashboard() {
     fetchData();
   }, []);
 
+  useEffect(() => {
+    if (!token) return;
+    const source = new EventSource(`/invoices/events?token=${encodeURIComponent(token)}`);
+    source.addEventListener('invoice', (e) => {
+      const update = JSON.parse(e.data);
+      setInvoices(prev => prev.map(invoice => invoice.id === update.id
+        ? { ...invoice, status: update.status, confidence: update.confidence }
+        : invoice));
+    });
+    source.addEventListener('invoice_deleted', (e) => {
+      const { id } = JSON.parse(e.data);
+      setInvoices(prev => prev.filter(invoice => invoice.id !== id));
+    });
+    source.addEventListener('reset', fetchData);
+    return () => source.close();
+  }, [token]);
+
   const exportCSV = async () => {
     try {
       const res = await axios.get('/invoices/export/csv', { responseType: 'blob' });
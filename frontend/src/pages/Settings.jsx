@@ -9,6 +9,7 @@ export default function Settings() {
   const [deepseekKey, setDeepseekKey] = useState('');
   const [openaiKey, setOpenaiKey] = useState('');
   const [defaultModel, setDefaultModel] = useState('deepseek-chat');
+  const [baseUrl, setBaseUrl] = useState('');
   const [saving, setSaving] = useState(false);
   const [message, setMessage] = useState('');
   const { user } = useAuth();
@@ -19,9 +20,10 @@ export default function Settings() {
 
   const fetchSettings = async () => {
     try {
-      const res = await axios.get('/users/settings');
+      const res = await axios.get('/settings/settings');
       setAiProvider(res.data.ai_provider || 'deepseek');
       setDefaultModel(res.data.default_model || 'deepseek-chat');
+      setBaseUrl(res.data.base_url || '');
     } catch (err) {
       console.error(err);
     }
@@ -31,11 +33,12 @@ export default function Settings() {
     setSaving(true);
     setMessage('');
     try {
-      await axios.put('/users/settings', {
+      await axios.put('/settings/settings', {
         ai_provider: aiProvider,
         deepseek_api_key: deepseekKey || undefined,
         openai_api_key: openaiKey || undefined,
-        default_model: defaultModel
+        default_model: defaultModel,
+        base_url: baseUrl || null
       });
       setMessage('Settings saved successfully!');
       setDeepseekKey('');
@@ -136,6 +139,20 @@ export default function Settings() {
               </select>
             </div>
 
+            <div>
+              <label className="block text-sm font-medium text-gray-700 mb-2">
+                API Base URL
+              </label>
+              <input
+                type="text"
+                value={baseUrl}
+                onChange={(e) => setBaseUrl(e.target.value)}
+                placeholder="https://your-openai-compatible-endpoint/v1"
+                className="w-full px-4 py-2 border rounded-lg focus:ring-2 focus:ring-blue-500"
+              />
+              <p className="text-sm text-gray-500 mt-1">Optional. Leave empty to use the provider's default endpoint</p>
+            </div>
+
             {message && (
               <p className={`text-sm ${message.includes('success') ? 'text-green-600' : 'text-red-600'}`}>
                 {message}
@@ -10,7 +10,7 @@ export default function Upload() {
   const [results, setResults] = useState([]);
   const [dragActive, setDragActive] = useState(false);
   const inputRef = useRef(null);
-  const { user } = useAuth();
+  const { user, token } = useAuth();
   const navigate = useNavigate();
 
   const handleDrag = (e) => {
@@ -41,7 +41,7 @@ export default function Upload() {
   const handleFiles = (newFiles) => {
     const validFiles = Array.from(newFiles).filter(f => 
       f.name.endsWith('.pdf') || f.name.endsWith('.png') || 
-      f.name.endsWith('.jpg') || f.name.endsWith('.jpeg')
+      f.name.endsWith('.jpg') || f.name.endsWith('.jpeg') || f.name.endsWith('.tiff')
     );
     setFiles(prev => [...prev, ...validFiles]);
   };
@@ -50,37 +50,92 @@ export default function Upload() {
     setFiles(prev => prev.filter((_, i) => i !== index));
   };
 
+  const addResult = (seen, invoice) => {
+    if (seen.has(invoice.id) || (invoice.status !== 'completed' && invoice.status !== 'failed')) return;
+    seen.add(invoice.id);
+    setResults(prev => [...prev, {
+      filename: invoice.filename,
+      status: invoice.status,
+      data: invoice.extracted_data,
+      error: invoice.error_message
+    }]);
+  };
+
+  const syncBatch = async (batchId, seen) => {
+    const res = await axios.get(`/invoices/batches/${batchId}`);
+    for (const item of res.data.items) {
+      if (seen.has(item.invoice_id) || (item.status !== 'completed' && item.status !== 'failed')) continue;
+      const invoice = item.status === 'completed' ? (await axios.get(`/invoices/${item.invoice_id}`)).data : null;
+      addResult(seen, {
+        id: item.invoice_id,
+        filename: item.filename,
+        status: item.status,
+        extracted_data: invoice?.extracted_data,
+        error_message: item.error_message
+      });
+    }
+    return res.data.finished;
+  };
+
+  const pollBatch = async (batchId, seen) => {
+    while (!(await syncBatch(batchId, seen))) {
+      await new Promise(resolve => setTimeout(resolve, 2000));
+    }
+  };
+
+  // Results arrive over the event stream; the batch endpoint only fills in what finished before it connected.
+  const waitForBatch = (batchId, invoiceIds) => new Promise((resolve, reject) => {
+    const seen = new Set();
+    const source = new EventSource(`/invoices/events?token=${encodeURIComponent(token)}`);
+    let done = false;
+    const finish = (promise) => {
+      if (done) return;
+      done = true;
+      source.close();
+      promise.then(resolve, reject);
+    };
+    const sync = () => syncBatch(batchId, seen).then(finished => finished && finish(Promise.resolve()), () => {});
+
+    source.onopen = sync;
+    source.addEventListener('reset', sync);
+    source.addEventListener('invoice', (e) => {
+      const invoice = JSON.parse(e.data);
+      if (invoiceIds.has(invoice.id)) addResult(seen, invoice);
+    });
+    source.addEventListener('batch', (e) => {
+      const batch = JSON.parse(e.data);
+      if (batch.id === batchId && batch.finished) finish(syncBatch(batchId, seen));
+    });
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) finish(pollBatch(batchId, seen));
+    };
+  });
+
   const uploadFiles = async () => {
     if (files.length === 0) return;
     setUploading(true);
     setResults([]);
 
     try {
-      for (const file of files) {
-        const formData = new FormData();
-        formData.append('files', file);
-        
-        try {
-          const res = await axios.post('/invoices/upload', formData);
-          const invoiceId = res.data.results[0]?.id;
-          
-          if (invoiceId) {
-            const processRes = await axios.post(`/invoices/process/${invoiceId}`);
-            setResults(prev => [...prev, { 
-              filename: file.name, 
-              status: processRes.data.status,
-              data: processRes.data.data,
-              error: processRes.data.error
-            }]);
-          }
-        } catch (err) {
-          setResults(prev => [...prev, { 
-            filename: file.name, 
-            status: 'failed',
-            error: err.message
-          }]);
-        }
+      const formData = new FormData();
+      files.forEach(file => formData.append('files', file));
+      formData.append('process', 'true');
+
+      const res = await axios.post('/invoices/upload', formData);
+      setResults(res.data.results
+        .filter(r => r.status === 'failed')
+        .map(r => ({ filename: r.filename, status: 'failed', error: r.error })));
+
+      if (res.data.batch_id) {
+        const invoiceIds = new Set(res.data.results.filter(r => r.id).map(r => r.id));
+        await waitForBatch(res.data.batch_id, invoiceIds);
       }
+    } catch (err) {
+      setResults(prev => [...prev, {
+        filename: `${files.length} file(s)`,
+        status: 'failed',
+        error: err.message
+      }]);
     } finally {
       setUploading(false);
     }
@@ -117,13 +172,13 @@ export default function Upload() {
             ref={inputRef}
             type="file"
             multiple
-            accept=".pdf,.png,.jpg,.jpeg"
+            accept=".pdf,.png,.jpg,.jpeg,.tiff"
             onChange={handleChange}
             className="hidden"
           />
           <UploadIcon className="mx-auto text-gray-400 mb-4" size={48} />
           <p className="text-gray-600 mb-2">Drag and drop your invoices here</p>
-          <p className="text-gray-400 text-sm">PDF, PNG, JPG, JPEG (max 50MB)</p>
+          <p className="text-gray-400 text-sm">PDF, PNG, JPG, JPEG, TIFF (max 50MB)</p>
         </div>
 
         {files.length > 0 && (